@@ -0,0 +1,279 @@
+import os
+import sys
+import csv
+import argparse
+
+import numpy as np
+
+# Batch geolocation for camera detections. The functions in
+# calculateGeoObjectDistance.py place one object at a time with scalar math
+# calls; here every step takes NumPy columns, so a chunk of detections is
+# placed with a handful of array operations. Input is streamed from CSV or
+# Parquet a chunk at a time and written out the same way, so memory stays
+# bounded however many detections a file holds. Parquet needs pyarrow,
+# which is imported when it is first used. Positions are great-circle on a
+# sphere by default, or along the WGS84 ellipsoid with model='wgs84'.
+# Focal lengths can come from a calibration registry, joined on camera_id.
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from geodesic import WGS84
+from calibrationRegistry import load_calibrations
+
+# Earth's mean radius in meters, as in calculateGeoObjectDistance.py
+EARTH_RADIUS = 6371000
+
+# Columns read from the input and added to the output
+INPUT_COLUMNS = ('camera_lat', 'camera_lon', 'bearing', 'pixel_width', 'known_width')
+OUTPUT_COLUMNS = ('distance', 'object_lat', 'object_lon')
+
+DEFAULT_CHUNK_SIZE = 250000
+
+# 'sphere' matches calculate_new_lat_lon; 'wgs84' solves on the ellipsoid
+MODELS = ('sphere', 'wgs84')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet I/O needs pyarrow: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+
+def focal_lengths(pixel_width, known_distance, known_width):
+    """Vectorized ``preFocalLength``."""
+    return np.asarray(pixel_width, dtype=np.float64) * known_distance / known_width
+
+
+def object_distances(known_width, focal_length, pixel_width):
+    """Vectorized ``distance_to_camera``: distance in meters for each detection."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(known_width, dtype=np.float64) * focal_length / pixel_width
+
+
+def destination_points(camera_lat, camera_lon, distance, bearing, radius=EARTH_RADIUS):
+    """
+    Vectorized ``calculate_new_lat_lon``: great-circle destinations in degrees.
+
+    All arguments broadcast against each other, so one camera position can
+    be paired with many distances and bearings. Returns ``(lat, lon)``.
+    """
+    lat1 = np.radians(camera_lat)
+    lon1 = np.radians(camera_lon)
+    theta = np.radians(bearing)
+    delta = np.asarray(distance, dtype=np.float64) / radius
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+
+    sin_lat2 = np.clip(sin_lat1 * cos_delta + cos_lat1 * sin_delta * np.cos(theta), -1.0, 1.0)
+    lat2 = np.arcsin(sin_lat2)
+    lon2 = lon1 + np.arctan2(np.sin(theta) * sin_delta * cos_lat1, cos_delta - sin_lat1 * sin_lat2)
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def geolocate(camera_lat, camera_lon, bearing, pixel_width, known_width, focal_length, model='sphere'):
+    """
+    Distance and position of every detection.
+
+    Takes columns of camera lat/lon, bearing (degrees from north), object
+    pixel width and known object width in meters, plus the focal length as
+    a scalar or a column. ``model`` is one of ``MODELS``. Returns
+    ``(distance, object_lat, object_lon)``.
+    """
+    if model not in MODELS:
+        raise ValueError("Model must be 'sphere' or 'wgs84'")
+    distance = object_distances(known_width, focal_length, pixel_width)
+    if model == 'wgs84':
+        object_lat, object_lon, _ = WGS84.direct(camera_lat, camera_lon, bearing, distance)
+    else:
+        object_lat, object_lon = destination_points(camera_lat, camera_lon, distance, bearing)
+    return distance, object_lat, object_lon
+
+
+def _floats(values):
+    """Column as float64; empty or unparsable entries become NaN."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        out = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+def _csv_chunks(path, chunk_size):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        width = len(header)
+        while True:
+            rows = []
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != width:
+                    # Missing trailing fields are empty; extra fields have no column to go to
+                    if len(row) > width:
+                        raise ValueError(f"{path}, line {reader.line_num}: {len(row)} fields, "
+                                         f"the header has {width}")
+                    row = row + [''] * (width - len(row))
+                rows.append(row)
+                if len(rows) == chunk_size:
+                    break
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            yield {name: np.array(column, dtype=object) for name, column in zip(header, columns)}
+            if len(rows) < chunk_size:
+                return
+
+
+def _parquet_chunks(path, chunk_size):
+    _, pq = _pyarrow()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield {name: column.to_numpy(zero_copy_only=False)
+               for name, column in zip(batch.schema.names, batch.columns)}
+
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield a CSV or Parquet file as ``{column: array}`` chunks of at most ``chunk_size`` rows.
+
+    CSV columns come back as strings and are converted where they are used.
+    """
+    if _is_parquet(path):
+        return _parquet_chunks(path, chunk_size)
+    return _csv_chunks(path, chunk_size)
+
+
+class ChunkWriter:
+    """
+    Append ``{column: array}`` chunks to a CSV or Parquet file.
+
+    The file is opened on the first chunk, whose columns set the header or
+    schema for the rest. Use as a context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._columns = None
+
+    def write(self, chunk):
+        if self._columns is None:
+            self._columns = list(chunk)
+            self._open(chunk)
+        if _is_parquet(self.path):
+            pa, _ = _pyarrow()
+            self._writer.write_table(pa.table({name: chunk[name] for name in self._columns},
+                                              schema=self._writer.schema))
+        else:
+            self._writer.writerows(zip(*(np.asarray(chunk[name]).tolist() for name in self._columns)))
+        self.rows += len(chunk[self._columns[0]])
+
+    def _open(self, chunk):
+        if _is_parquet(self.path):
+            pa, pq = _pyarrow()
+            # Schema from the first chunk; later chunks are cast to it
+            schema = pa.table({name: chunk[name] for name in self._columns}).schema
+            self._writer = pq.ParquetWriter(self.path, schema)
+        else:
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self._columns)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+        self._file = self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def geolocate_chunk(chunk, focal_length=None, model='sphere', calibrations=None):
+    """
+    Add ``distance``, ``object_lat`` and ``object_lon`` to a chunk.
+
+    The focal length comes from a ``focal_length`` column in the chunk if
+    there is one, otherwise from ``calibrations`` (a ``CalibrationCache``)
+    by the chunk's ``camera_id``, with the ``focal_length`` argument for
+    cameras that are not calibrated. Rows with missing inputs get NaN.
+    """
+    missing = [name for name in INPUT_COLUMNS if name not in chunk]
+    if missing:
+        raise KeyError(f"Input is missing columns: {', '.join(missing)}")
+    if 'focal_length' in chunk:
+        focal_length = _floats(chunk['focal_length'])
+    elif calibrations is not None:
+        if 'camera_id' not in chunk:
+            raise KeyError("Input needs a camera_id column to join calibrations")
+        calibrated = calibrations.focal_lengths(chunk['camera_id'])
+        if focal_length is not None:
+            calibrated = np.where(np.isnan(calibrated), focal_length, calibrated)
+        focal_length = calibrated
+    elif focal_length is None:
+        raise ValueError("Give a focal length, a focal_length column or calibrations")
+    columns = [_floats(chunk[name]) for name in INPUT_COLUMNS]
+    # Input columns go out as numbers, so Parquet output gets numeric types
+    chunk = dict(chunk)
+    chunk.update(zip(INPUT_COLUMNS, columns))
+    chunk.update(zip(OUTPUT_COLUMNS, geolocate(*columns, focal_length, model)))
+    return chunk
+
+
+def geolocate_file(in_path, out_path, focal_length=None, chunk_size=DEFAULT_CHUNK_SIZE, model='sphere',
+                   calibrations=None):
+    """
+    Geolocate every detection in a CSV or Parquet file.
+
+    The input is read ``chunk_size`` rows at a time and each chunk is
+    written out before the next is read, so only one chunk is in memory.
+    Input columns are passed through and the output format follows the
+    ``out_path`` extension. ``calibrations`` is a ``CalibrationCache`` or
+    the path of a calibration registry. Returns the number of rows written.
+    """
+    if isinstance(calibrations, str):
+        calibrations = load_calibrations(calibrations)
+    with ChunkWriter(out_path) as writer:
+        for chunk in read_chunks(in_path, chunk_size):
+            writer.write(geolocate_chunk(chunk, focal_length, model, calibrations))
+    return writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geolocate camera detections from a CSV or Parquet file.")
+    parser.add_argument("input", help="CSV or Parquet with " + ", ".join(INPUT_COLUMNS) + " columns")
+    parser.add_argument("output", help="CSV or Parquet file to write, chosen by extension")
+    parser.add_argument("--focal-length", type=float, default=None,
+                        help="Focal length for rows without a focal_length column or a calibrated camera")
+    parser.add_argument("--calibrations", default=None,
+                        help="Calibration registry (SQLite) to join on the camera_id column")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows read at a time (default {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--model", choices=MODELS, default='sphere',
+                        help="Earth model: sphere (default) or wgs84 ellipsoid")
+    args = parser.parse_args()
+
+    rows = geolocate_file(args.input, args.output, args.focal_length, args.chunk_size, args.model,
+                          args.calibrations)
+    print(f"{rows} detections geolocated and saved at {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import math
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+# Throughput of the spherical and WGS84 destination solvers on synthetic
+# detections, and how far apart their answers land. Points are generated and
+# solved a chunk at a time so 10M points fit in a few hundred MB.
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batchGeolocate import EARTH_RADIUS, destination_points
+from geodesic import WGS84
+
+# Scalar baseline rows; the loop is too slow to run on every point
+SCALAR_SAMPLE = 200000
+
+
+def _scalar_destination(camera_lat, camera_lon, distance, bearing):
+    # calculate_new_lat_lon from calculateGeoObjectDistance.py, which runs
+    # its example on import
+    lat1 = math.radians(camera_lat)
+    lon1 = math.radians(camera_lon)
+    bearing = math.radians(bearing)
+    new_lat = math.asin(math.sin(lat1) * math.cos(distance / EARTH_RADIUS) +
+                        math.cos(lat1) * math.sin(distance / EARTH_RADIUS) * math.cos(bearing))
+    new_lon = lon1 + math.atan2(math.sin(bearing) * math.sin(distance / EARTH_RADIUS) * math.cos(lat1),
+                                math.cos(distance / EARTH_RADIUS) - math.sin(lat1) * math.sin(new_lat))
+    return math.degrees(new_lat), math.degrees(new_lon)
+
+
+def detections(rng, n, per_camera, max_distance):
+    """Camera lat/lon, bearing and distance for ``n`` detections, ``per_camera`` rows per camera."""
+    cameras = -(-n // per_camera)
+    lat = np.repeat(rng.uniform(-80, 80, cameras), per_camera)[:n]
+    lon = np.repeat(rng.uniform(-180, 180, cameras), per_camera)[:n]
+    return lat, lon, rng.uniform(0, 360, n), rng.uniform(1, max_distance, n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spherical against WGS84 destination points.")
+    parser.add_argument("--points", type=int, default=10000000, help="Detections to solve (default 10M)")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="Detections per chunk (default 1M)")
+    parser.add_argument("--per-camera", type=int, default=1000,
+                        help="Consecutive detections sharing a camera position (default 1000)")
+    parser.add_argument("--max-distance", type=float, default=100000.0,
+                        help="Longest detection distance in meters (default 100 km)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    timings = {'sphere': 0.0, 'wgs84': 0.0}
+    worst = 0.0
+    relative = 0.0
+    done = 0
+    while done < args.points:
+        n = min(args.chunk_size, args.points - done)
+        lat, lon, bearing, distance = detections(rng, n, args.per_camera, args.max_distance)
+
+        start = perf_counter()
+        sphere_lat, sphere_lon = destination_points(lat, lon, distance, bearing)
+        timings['sphere'] += perf_counter() - start
+
+        start = perf_counter()
+        wgs_lat, wgs_lon, _ = WGS84.direct(lat, lon, bearing, distance)
+        timings['wgs84'] += perf_counter() - start
+
+        # Where the spherical answer lands measured on the ellipsoid
+        error, _, _ = WGS84.inverse(wgs_lat, wgs_lon, sphere_lat, sphere_lon)
+        worst = max(worst, np.nanmax(error))
+        relative = max(relative, np.nanmax(error / distance))
+        done += n
+
+    sample = min(SCALAR_SAMPLE, args.points)
+    lat, lon, bearing, distance = detections(rng, sample, args.per_camera, args.max_distance)
+    start = perf_counter()
+    for row in zip(lat.tolist(), lon.tolist(), distance.tolist(), bearing.tolist()):
+        _scalar_destination(*row)
+    scalar = (perf_counter() - start) / sample
+
+    print(f"{args.points:,} points in chunks of {args.chunk_size:,}, {args.per_camera} per camera")
+    print(f"  scalar sphere  {1 / scalar:>14,.0f} points/s (from {sample:,} points)")
+    for model, seconds in timings.items():
+        print(f"  vector {model:<7} {args.points / seconds:>14,.0f} points/s ({seconds:.2f} s)")
+    print(f"Sphere vs WGS84: up to {worst:.2f} m apart, {relative:.3%} of the detection distance")
+
+
+if __name__ == "__main__":
+    main()
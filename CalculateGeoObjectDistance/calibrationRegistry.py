@@ -0,0 +1,243 @@
+import os
+import csv
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Persistent camera calibrations. Each camera's focal length is fitted by
+# least squares from its reference measurements (an object of known width
+# photographed at a known distance) and stored in SQLite with its lens
+# parameters, keyed by camera ID. A batch run loads the table once into a
+# CalibrationCache and joins detections to it with a dict lookup per row
+# instead of recomputing preFocalLength.
+
+# Loaded registries: absolute path -> ((mtime_ns, size), CalibrationCache)
+_CACHES = {}
+
+# Lens parameters kept with each calibration besides the focal length
+LENS_COLUMNS = ('image_width', 'image_height', 'k1', 'k2')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    camera_id TEXT NOT NULL,
+    pixel_width REAL NOT NULL,
+    known_distance REAL NOT NULL,
+    known_width REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_camera ON measurements (camera_id);
+CREATE TABLE IF NOT EXISTS calibrations (
+    camera_id TEXT PRIMARY KEY,
+    focal_length REAL NOT NULL,
+    rmse REAL,
+    samples INTEGER NOT NULL,
+    image_width REAL,
+    image_height REAL,
+    k1 REAL,
+    k2 REAL,
+    updated TEXT NOT NULL
+);
+"""
+
+
+def fit_focal_length(pixel_widths, known_distances, known_widths):
+    """
+    Least-squares focal length from reference measurements.
+
+    ``preFocalLength`` gives ``f = p * D / W`` for one measurement, i.e.
+    ``p = f * x`` with ``x = W / D``. Over several measurements the
+    least-squares ``f`` is ``sum(p * x) / sum(x ** 2)``. Measurements with
+    missing values are left out. Returns ``(focal_length, rmse, samples)``
+    with the RMSE in pixel-width units and ``samples`` the number of
+    measurements used.
+    """
+    p = np.asarray(pixel_widths, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.asarray(known_widths, dtype=np.float64) / np.asarray(known_distances, dtype=np.float64)
+    keep = np.isfinite(p) & np.isfinite(x)
+    p, x = p[keep], x[keep]
+    if not len(p) or not np.any(x):
+        raise ValueError("Need at least one measurement with a non-zero known width")
+    focal_length = float(np.dot(p, x) / np.dot(x, x))
+    rmse = float(np.sqrt(np.mean((p - focal_length * x) ** 2)))
+    return focal_length, rmse, len(p)
+
+
+class CalibrationCache:
+    """
+    In-memory copy of the calibrations table for joining detections.
+
+    ``index`` maps camera ID to a row of the ``focal_length`` array and of
+    the lens arrays in ``lens``. IDs are compared as strings.
+    """
+
+    def __init__(self, camera_ids, focal_lengths, lens=None):
+        self.index = {str(camera_id): i for i, camera_id in enumerate(camera_ids)}
+        self.focal_length = np.asarray(focal_lengths, dtype=np.float64)
+        self.lens = {name: np.asarray(values, dtype=np.float64) for name, values in (lens or {}).items()}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, camera_id):
+        return str(camera_id) in self.index
+
+    def rows(self, camera_ids):
+        """Row of each camera ID in the cache, -1 when it has no calibration."""
+        index = self.index
+        camera_ids = camera_ids.tolist() if isinstance(camera_ids, np.ndarray) else camera_ids
+        return np.fromiter((index.get(str(camera_id), -1) for camera_id in camera_ids),
+                           dtype=np.int64, count=len(camera_ids))
+
+    def focal_lengths(self, camera_ids):
+        """Focal length of each detection's camera; NaN for uncalibrated cameras."""
+        return self._gather(self.focal_length, self.rows(camera_ids))
+
+    def lens_values(self, name, camera_ids):
+        """One lens parameter for each detection's camera; NaN when unknown."""
+        return self._gather(self.lens[name], self.rows(camera_ids))
+
+    @staticmethod
+    def _gather(values, rows):
+        if not len(values):
+            return np.full(len(rows), np.nan)
+        return np.where(rows >= 0, values[np.maximum(rows, 0)], np.nan)
+
+
+class CalibrationRegistry:
+    """
+    SQLite store of reference measurements and fitted calibrations.
+
+    Tables are created on first use. Use as a context manager, or call
+    ``close``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def add_measurements(self, camera_id, pixel_widths, known_distances, known_widths):
+        """Store reference measurements for a camera. Returns how many were added."""
+        rows = [(str(camera_id), float(p), float(d), float(w))
+                for p, d, w in zip(pixel_widths, known_distances, known_widths)]
+        with self.connection:
+            self.connection.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def measurements(self, camera_id):
+        """``(pixel_widths, known_distances, known_widths)`` arrays for a camera."""
+        rows = self.connection.execute(
+            "SELECT pixel_width, known_distance, known_width FROM measurements WHERE camera_id = ?",
+            (str(camera_id),)).fetchall()
+        values = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        return values[:, 0], values[:, 1], values[:, 2]
+
+    def set_calibration(self, camera_id, focal_length, rmse=None, samples=0, **lens):
+        """Insert or replace a camera's calibration; ``lens`` takes ``LENS_COLUMNS`` values."""
+        unknown = set(lens) - set(LENS_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown lens parameters: {', '.join(sorted(unknown))}")
+        current = self.get(camera_id) or {}
+        values = [current.get(name) if lens.get(name) is None else lens[name] for name in LENS_COLUMNS]
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO calibrations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [str(camera_id), float(focal_length), rmse, int(samples)] + values
+                + [datetime.now(timezone.utc).isoformat(timespec='seconds')])
+        # Caches of this file are stale now
+        _CACHES.pop(os.path.abspath(self.path), None)
+
+    def calibrate(self, camera_id, **lens):
+        """
+        Fit a camera's focal length from its stored measurements and save it.
+
+        Lens parameters already stored are kept unless given. Returns
+        ``(focal_length, rmse)``.
+        """
+        focal_length, rmse, samples = fit_focal_length(*self.measurements(camera_id))
+        self.set_calibration(camera_id, focal_length, rmse, samples, **lens)
+        return focal_length, rmse
+
+    def calibrate_all(self):
+        """Refit every camera that has measurements. Returns ``{camera_id: (focal_length, rmse)}``."""
+        camera_ids = [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT camera_id FROM measurements ORDER BY camera_id")]
+        return {camera_id: self.calibrate(camera_id) for camera_id in camera_ids}
+
+    def get(self, camera_id):
+        """A camera's calibration as a dict, or None."""
+        cursor = self.connection.execute("SELECT * FROM calibrations WHERE camera_id = ?", (str(camera_id),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+
+    def load(self):
+        """Read the whole calibrations table into a ``CalibrationCache``."""
+        rows = self.connection.execute(
+            "SELECT camera_id, focal_length, " + ", ".join(LENS_COLUMNS) + " FROM calibrations").fetchall()
+        columns = list(zip(*rows)) or [()] * (2 + len(LENS_COLUMNS))
+        lens = {name: [np.nan if v is None else v for v in values]
+                for name, values in zip(LENS_COLUMNS, columns[2:])}
+        return CalibrationCache(columns[0], columns[1], lens)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_calibrations(path, reload=False):
+    """
+    ``CalibrationCache`` for a registry file, read once per process.
+
+    The cache is read again when the file has changed since it was loaded
+    (its modification time or size differs), after a ``CalibrationRegistry``
+    in this process wrote a calibration, or with ``reload``.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _CACHES.get(key)
+    if reload or cached is None or cached[0] != version:
+        with CalibrationRegistry(path) as registry:
+            cached = _CACHES[key] = (version, registry.load())
+    return cached[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Camera calibration registry.")
+    parser.add_argument("registry", help="SQLite file (created if missing)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="Add reference measurements from a CSV")
+    add.add_argument("csv", help="CSV with camera_id, pixel_width, known_distance, known_width")
+    commands.add_parser("fit", help="Refit the focal length of every camera with measurements")
+    commands.add_parser("list", help="Print the stored calibrations")
+    args = parser.parse_args()
+
+    with CalibrationRegistry(args.registry) as registry:
+        if args.command == "add":
+            with open(args.csv, newline='', encoding='utf-8') as f:
+                by_camera = {}
+                for row in csv.DictReader(f):
+                    by_camera.setdefault(row['camera_id'], []).append(
+                        (row['pixel_width'], row['known_distance'], row['known_width']))
+            count = sum(registry.add_measurements(camera_id, *zip(*rows)) for camera_id, rows in by_camera.items())
+            print(f"{count} measurements added for {len(by_camera)} cameras")
+        elif args.command == "fit":
+            for camera_id, (focal_length, rmse) in registry.calibrate_all().items():
+                print(f"{camera_id}: focal length {focal_length:.4f} (RMSE {rmse:.4g})")
+        else:
+            for row in registry.connection.execute(
+                    "SELECT camera_id, focal_length, rmse, samples, updated FROM calibrations ORDER BY camera_id"):
+                print(*row, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
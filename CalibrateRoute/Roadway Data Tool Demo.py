@@ -1,55 +1,157 @@
+import os
+import sys
+import csv
+import time
 import arcpy
 import numpy as np
 
-# Define the distance function
-def distance(point1, point2):
-    return np.sqrt((point2[0] - point1[0])**2 + (point2[1] - point1[1])**2)
+# The calibration engine lives next to the toolbox and has no arcpy dependency
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from routeCalibration import (RouteGeometry, SegmentIndex, calibrate_geometry, calibrate_measures,
+                              calibrate_to_anchors, snap_anchors)
 
+def polyline_vertices(polyline):
+    """Flat (n, 2) vertex array and part offsets of a polyline."""
+    geometry = RouteGeometry.from_parts([[[(point.X, point.Y) for point in part] for part in polyline]])
+    return geometry.xy, geometry.part_offsets
 
-def interpolate_distances(points):
-    interpolated_points = []
-    total_distance = 0.0
-    cumulative_distances = [0.0]
-
-    # Calculate cumulative distances and total distance
-    for i in range(1, len(points)):
-        dist = distance(points[i - 1], points[i])
-        total_distance += dist
-        cumulative_distances.append(total_distance)
-
-    # Sort points based on cumulative distances
-    sorted_points = [point for _, point in sorted(zip(cumulative_distances, points))]
-
-    # Linearly interpolate distances
-    for i in range(1, len(sorted_points)):
-        sorted_points[i][2] = np.interp(
-            cumulative_distances[i],
-            [0, total_distance],
-            [sorted_points[0][2], sorted_points[-1][2]]
-        )
-        interpolated_points.append(sorted_points[i])
-
-    return interpolated_points
 
 def update_geometry_with_measures(polyline, measures):
     # Create a new array to hold the updated geometry
     updated_geometry = arcpy.Array()
+    # Measures run on across parts, so they are indexed by vertex within the whole polyline
+    index = 0
     
     # Loop through each part of the polyline
     for part in polyline:
+        updated_part = arcpy.Array()
         # Loop through each vertex in the part
         for i in range(part.count):
             point = part.getObject(i)
             # Get the measure value for this vertex
-            measure = measures[i] if i < len(measures) else None
+            measure = measures[index] if index < len(measures) else None
             # Update the M value of the point
             point.M = measure
-            updated_geometry.add(point)
+            updated_part.add(point)
+            index += 1
+        updated_geometry.add(updated_part)
     
-    # Create a new Polyline object with the updated geometry
-    updated_polyline = arcpy.Polyline(updated_geometry)
+    # Create a new Polyline object with the updated geometry, keeping its parts
+    updated_polyline = arcpy.Polyline(updated_geometry, polyline.spatialReference, polyline.hasZ, True)
     
     return updated_polyline
+
+
+class CalibrationProgress(object):
+    """
+    Progress and telemetry for a calibration run.
+
+    Per route it only bumps counters and, at most every ``interval`` seconds,
+    moves the progressor, so messaging cost does not grow with route length.
+    The full measure list of every route is written only when a verbose log
+    file is given. Totals and routes/sec and vertices/sec are reported once
+    at the end.
+    """
+
+    def __init__(self, label, total, verbose_path=None, interval=0.5):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.routes = 0
+        self.vertices = 0
+        self.start = time.perf_counter()
+        self._next_update = self.start
+        self._log = None
+        if verbose_path:
+            self._log = open(verbose_path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._log)
+            self._writer.writerow(["oid", "from_measure", "to_measure", "vertices", "measures"])
+        arcpy.SetProgressor("step", label, 0, max(total, 1), 1)
+
+    def route(self, oid, from_measure, to_measure, measures):
+        self.routes += 1
+        self.vertices += len(measures)
+        if self._log:
+            self._writer.writerow([oid, from_measure, to_measure, len(measures),
+                                   " ".join(f"{m:.6f}" for m in measures)])
+        now = time.perf_counter()
+        if now >= self._next_update:
+            self._next_update = now + self.interval
+            arcpy.SetProgressorPosition(self.routes)
+            arcpy.SetProgressorLabel(f"{self.label} ({self.routes} of {self.total} routes)")
+
+    def finish(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        arcpy.ResetProgressor()
+        if self._log:
+            self._log.close()
+            self._log = None
+        arcpy.AddMessage(f'Calibrated {self.routes} routes ({self.vertices} vertices) in {elapsed:.1f}s: '
+                         f'{self.routes / elapsed:.0f} routes/sec, {self.vertices / elapsed:.0f} vertices/sec')
+
+
+def read_routes(in_polyline, attr_from_meas=None, attr_to_meas=None):
+    """Read every route's vertices (and measure fields) in one pass, in cursor order."""
+    # WKB carries the part breaks with the coordinates, and is decoded with
+    # NumPy a part at a time rather than a point at a time. Null and empty
+    # shapes are left out, so they get no route and are never written back.
+    oids, blobs = [], []
+    with arcpy.da.SearchCursor(in_polyline, ["OID@", "SHAPE@WKB"]) as cursor:
+        for oid, wkb in cursor:
+            if wkb is not None:
+                oids.append(oid)
+                blobs.append(wkb)
+    geometry = RouteGeometry.from_wkb(blobs)
+    del blobs
+    oids = np.array(oids, dtype=np.int64)
+    parts = np.diff(geometry.route_parts)
+    if not parts.all():
+        # Empty shapes have no parts left, so only the route list changes
+        geometry = RouteGeometry.from_counts(geometry.xy, np.diff(geometry.part_offsets), parts[parts > 0])
+        oids = oids[parts > 0]
+
+    from_measures = to_measures = None
+    if attr_from_meas and attr_to_meas:
+        attrs = arcpy.da.FeatureClassToNumPyArray(in_polyline, ["OID@", attr_from_meas, attr_to_meas],
+                                                  skip_nulls=False,
+                                                  null_value={attr_from_meas: np.nan, attr_to_meas: np.nan})
+        attrs = attrs[np.argsort(attrs["OID@"])]
+        rows = np.searchsorted(attrs["OID@"], oids)
+        from_measures = attrs[attr_from_meas][rows].astype(np.float64)
+        to_measures = attrs[attr_to_meas][rows].astype(np.float64)
+    return oids, geometry, from_measures, to_measures
+
+
+def calibrate_layer_parallel(in_polyline, workers, from_measure=None, to_measure=None,
+                             attr_from_meas=None, attr_to_meas=None, verbose_path=None):
+    """Bulk read, calibrate in a process pool, then write every route back in one update pass."""
+    if sys.platform == "win32":
+        # Inside ArcGIS Pro sys.executable is the application, not Python
+        import multiprocessing
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+
+    oids, geometry, from_measures, to_measures = read_routes(in_polyline, attr_from_meas, attr_to_meas)
+    if from_measures is None:
+        from_measures = np.full(len(oids), from_measure, dtype=np.float64)
+        to_measures = np.full(len(oids), to_measure, dtype=np.float64)
+    arcpy.AddMessage(f'Read {len(oids)} routes with {len(geometry.xy)} vertices; calibrating with {workers} workers')
+    measures = calibrate_geometry(geometry, from_measures, to_measures, workers=workers)
+    offsets = geometry.offsets
+
+    route_index = {oid: i for i, oid in enumerate(oids.tolist())}
+    progress = CalibrationProgress("Writing measures", len(oids), verbose_path)
+    with arcpy.da.UpdateCursor(in_polyline, ["OID@", "SHAPE@"]) as cursor:
+        for oid, polyline in cursor:
+            i = route_index.get(oid)
+            if i is None or polyline is None:
+                continue
+            route_measures = measures[offsets[i]:offsets[i + 1]].tolist()
+            cursor.updateRow([oid, update_geometry_with_measures(polyline, route_measures)])
+            progress.route(oid, from_measures[i], to_measures[i], route_measures)
+    progress.finish()
+    return progress.routes
+
+
 class Toolbox(object):
     def __init__(self):
         """Define the toolbox (the name of the toolbox is the name of the
@@ -57,7 +159,7 @@ class Toolbox(object):
         self.label = "Roadway Management Tool Demo"
         self.alias = "Roadway Management Tool Demo"
         # List of tool classes associated with this toolbox
-        self.tools = [CalibrateRoutes]
+        self.tools = [CalibrateRoutes, CalibrateRoutesFromPoints]
 
 class CalibrateRoutes(object):
     def __init__(self):
@@ -141,7 +243,25 @@ class CalibrateRoutes(object):
             direction="Input")
         param5.parameterDependencies = [param0.name]
 
-        return [param0, param1, param2, param3, param4, param5]
+        # Parameter 7: Optional input - Worker processes for batch calibration
+        param6 = arcpy.Parameter(
+            displayName="Parallel Workers",
+            name="workers",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+        param6.value = 1
+
+        # Parameter 8: Optional output - Per-route measure dump
+        param7 = arcpy.Parameter(
+            displayName="Verbose Log File",
+            name="verbose_log",
+            datatype="DEFile",
+            parameterType="Optional",
+            direction="Output")
+        param7.filter.list = ["csv", "txt"]
+
+        return [param0, param1, param2, param3, param4, param5, param6, param7]
 
     def execute(self, parameters, messages):
         """Calibrate route measures"""
@@ -155,71 +275,188 @@ class CalibrateRoutes(object):
         attr_from_meas = parameters[4].valueAsText if parameters[4].value else None
         # Get optional input - Attribute To Meas
         attr_to_meas = parameters[5].valueAsText if parameters[5].value else None
-        attr = 'True' if use_attribute else 'False'
+        # Get optional input - Worker processes; more than one switches to batch calibration
+        workers = parameters[6].value or 1
+        # Get optional output - Every route's measures go here instead of the messages
+        verbose_path = parameters[7].valueAsText if parameters[7].value else None
         arcpy.AddMessage(f'Starting to calibrate M-Values for {in_polyline}')
 
+        if workers > 1:
+            if use_attribute:
+                calibrate_layer_parallel(in_polyline, workers, attr_from_meas=attr_from_meas,
+                                         attr_to_meas=attr_to_meas, verbose_path=verbose_path)
+            else:
+                calibrate_layer_parallel(in_polyline, workers, from_measure_, to_measure_,
+                                         verbose_path=verbose_path)
+            return
 
         # Perform calibration operations here
-        count =1
-        if not use_attribute:
-            
-            arcpy.AddMessage(f'|{"Item":<10} |{"From Measure":<10} | {"To Measure":<10} | {"Use Attribute":<10} | {"Status":<10} | {"Vertices with M-Values":<10} |')
-            # Create an update cursor to iterate over the polylines
-            with arcpy.da.UpdateCursor(in_polyline, ["SHAPE@"]) as cursor:
-                arcpy.AddMessage(f'|{count:<10} | {in_polyline:<15} | {from_measure_:<15} | {to_measure_:<15} | {attr:<15} | {"Processing":<15} | {"[]":<22} |')
-                for row in cursor:
-                    polyline = row[0]
-                    
-                    # Get the vertices of the polyline
-                    vertices = [[point.X, point.Y, None] for part in polyline for point in part]
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure_:<10} | {to_measure_:<15} | {attr:<15} | {"Processing":<15} | {str(len(vertices)):<22} |')
-                    # Add from_measure to the first vertex and to_measure to the last vertex
-                    vertices[0][2] = from_measure_
-                    vertices[-1][2] = to_measure_
-                    
-                    # Interpolate distances and update measures
-                    interpolated_points = interpolate_distances(vertices)
-                    interpolated_points = [vertices[0]] + interpolated_points
-                    measures = [point[2] for point in interpolated_points]
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure_:<15} | {to_measure_:<15} | {attr:<15} | {"Updated":<15} | {str(measures):<50} |')
-                    # Update geometry with measure values
-                    updated_polyline = update_geometry_with_measures(polyline, measures)
-                    
-                    # Update the geometry of the feature
-                    cursor.updateRow([updated_polyline])
-                    count +=1
-
-                arcpy.AddMessage(f'|{from_measure_:<10} | {to_measure_:<15} | {attr:<15} | {"Calibrated":<15} | {str(measures):<50} |')
-        else:
-            arcpy.AddMessage(f'|{"Item":<10} |{"From Measure":<15} | {"To Measure":<15} | {"Use Attribute":<15} | {"Status":<15} | {"Vertices with M-Values":<10} |')
-            # Create an update cursor to iterate over the polylines
-            with arcpy.da.UpdateCursor(in_polyline, ["SHAPE@", attr_from_meas, attr_to_meas]) as cursor:
-                
-                for row in cursor:
-                    polyline = row[0]
-                    from_measure = row[1]
-                    to_measure = row[2]
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure:<15} | {to_measure:<15} | {attr:<15} | {"Processing":<15} | {"[]":<22} |')
-                    # Get the vertices of the polyline
-                    vertices = [[point.X, point.Y, None] for part in polyline for point in part]
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure:<15} | {to_measure:<15} | {attr:<15} | {"Processing":<15} | {str(len(vertices)):<22} |')
-                    # Add from_measure to the first vertex and to_measure to the last vertex
-                    vertices[0][2] = from_measure
-                    vertices[-1][2] = to_measure
-                    
-                    # Interpolate distances and update measures
-                    interpolated_points = interpolate_distances(vertices)
-                    interpolated_points = [vertices[0]] + interpolated_points
-                    measures = [point[2] for point in interpolated_points]
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure:<15} | {to_measure:<15} | {attr:<15} | {"Updated":<15} | {str(measures):<50} |')
-                    # Update geometry with measure values
-                    updated_polyline = update_geometry_with_measures(polyline, measures)
-                    
-                    # Update the geometry of the feature
-                    cursor.updateRow([updated_polyline, from_measure, to_measure])
-                    
-                    arcpy.AddMessage(f'|{count:<10} |{from_measure:<15} | {to_measure:<15} | {attr:<15} | {"Calibrated":<15} | {str(measures):<50} |')
-                    arcpy.AddMessage('='*145)
-                    count+=1
+        total = int(arcpy.management.GetCount(in_polyline)[0])
+        progress = CalibrationProgress("Calibrating routes", total, verbose_path)
+        fields = ["OID@", "SHAPE@", attr_from_meas, attr_to_meas] if use_attribute else ["OID@", "SHAPE@"]
+        # Create an update cursor to iterate over the polylines
+        with arcpy.da.UpdateCursor(in_polyline, fields) as cursor:
+            for row in cursor:
+                polyline = row[1]
+                if polyline is None:
+                    continue
+                from_measure, to_measure = (row[2], row[3]) if use_attribute else (from_measure_, to_measure_)
+
+                # Get the vertices of the polyline
+                vertices, part_offsets = polyline_vertices(polyline)
+                # from_measure on the first vertex, to_measure on the last, interpolated by distance between
+                measures = calibrate_measures(vertices, from_measure, to_measure, part_offsets).tolist()
+                # Update geometry with measure values
+                row[1] = update_geometry_with_measures(polyline, measures)
+
+                # Update the geometry of the feature
+                cursor.updateRow(row)
+                progress.route(row[0], from_measure, to_measure, measures)
+
+        progress.finish()
+        return
+
+
+class CalibrateRoutesFromPoints(object):
+    def __init__(self):
+        """Define the tool (tool name is the name of the class)."""
+        self.label = "Calibrate Routes From Points"
+        self.description = ("Calibrate route measures against a layer of calibration points, "
+                            "interpolating piecewise between every pair of points along each route.")
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        """Define parameter definitions"""
+
+        # Parameter 1: Input polyline feature layer
+        param0 = arcpy.Parameter(
+            displayName="Input Route Layer",
+            name="input_route",
+            datatype="GPFeatureLayer",
+            parameterType="Required",
+            direction="Input")
+        param0.filter.list = ["Polyline"]
+
+        # Parameter 2: Route identifier on the routes
+        param1 = arcpy.Parameter(
+            displayName="Route ID Field - Route Layer",
+            name="route_id_field",
+            datatype="Field",
+            parameterType="Required",
+            direction="Input")
+        param1.parameterDependencies = [param0.name]
+
+        # Parameter 3: Calibration points (e.g. mile markers)
+        param2 = arcpy.Parameter(
+            displayName="Calibration Point Layer",
+            name="calibration_points",
+            datatype="GPFeatureLayer",
+            parameterType="Required",
+            direction="Input")
+        param2.filter.list = ["Point"]
+
+        # Parameter 4: Route identifier on the points
+        param3 = arcpy.Parameter(
+            displayName="Route ID Field - Point Layer",
+            name="point_route_id_field",
+            datatype="Field",
+            parameterType="Required",
+            direction="Input")
+        param3.parameterDependencies = [param2.name]
+
+        # Parameter 5: Measure carried by each point
+        param4 = arcpy.Parameter(
+            displayName="Measure Field - Point Layer",
+            name="measure_field",
+            datatype="Field",
+            parameterType="Required",
+            direction="Input")
+        param4.parameterDependencies = [param2.name]
+        param4.filter.list = ["Short", "Long", "Float", "Double"]
+
+        # Parameter 6: How far a point may be from its route, in map units
+        param5 = arcpy.Parameter(
+            displayName="Search Radius (map units)",
+            name="search_radius",
+            datatype="GPDouble",
+            parameterType="Required",
+            direction="Input")
+        param5.value = 10.0
+
+        # Parameter 7: Extend the first/last slope past the outermost points
+        param6 = arcpy.Parameter(
+            displayName="Extrapolate Beyond End Points",
+            name="extrapolate",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input")
+        param6.value = True
+
+        # Parameter 8: Optional output - Per-route measure dump
+        param7 = arcpy.Parameter(
+            displayName="Verbose Log File",
+            name="verbose_log",
+            datatype="DEFile",
+            parameterType="Optional",
+            direction="Output")
+        param7.filter.list = ["csv", "txt"]
+
+        return [param0, param1, param2, param3, param4, param5, param6, param7]
+
+    def execute(self, parameters, messages):
+        """Calibrate route measures against calibration points"""
+
+        in_polyline = parameters[0].valueAsText
+        route_id_field = parameters[1].valueAsText
+        in_points = parameters[2].valueAsText
+        point_route_id_field = parameters[3].valueAsText
+        measure_field = parameters[4].valueAsText
+        search_radius = parameters[5].value
+        extrapolate = parameters[6].value is not False
+        verbose_path = parameters[7].valueAsText if parameters[7].value else None
+        arcpy.AddMessage(f'Starting to calibrate M-Values for {in_polyline} from {in_points}')
+
+        oids, geometry, _, _ = read_routes(in_polyline)
+        with arcpy.da.SearchCursor(in_polyline, ["OID@", route_id_field]) as cursor:
+            ids = dict(cursor)
+        route_ids = [ids.get(oid) for oid in oids.tolist()]
+
+        points = arcpy.da.FeatureClassToNumPyArray(in_points, ["SHAPE@X", "SHAPE@Y", point_route_id_field,
+                                                               measure_field], skip_nulls=True)
+        # Route IDs become small integer codes so points only snap to their own route
+        codes = {}
+        route_keys = np.array([codes.setdefault(rid, len(codes)) for rid in route_ids], dtype=np.int64)
+        point_keys = np.array([codes.get(pid, -1) for pid in points[point_route_id_field].tolist()],
+                              dtype=np.int64)
+
+        xy = np.column_stack([points["SHAPE@X"], points["SHAPE@Y"]])
+        index = SegmentIndex(geometry, min_cell_size=search_radius)
+        route, along, _ = snap_anchors(geometry, xy, search_radius, point_keys, route_keys, index)
+        found = route >= 0
+        arcpy.AddMessage(f'Snapped {int(found.sum())} of {len(xy)} calibration points to their routes')
+
+        measures = calibrate_to_anchors(geometry, route[found], along[found],
+                                        points[measure_field][found].astype(np.float64), extrapolate)
+        offsets = geometry.offsets
+        route_index = {oid: i for i, oid in enumerate(oids.tolist())}
 
+        progress = CalibrationProgress("Writing measures", len(oids), verbose_path)
+        skipped = 0
+        with arcpy.da.UpdateCursor(in_polyline, ["OID@", "SHAPE@"]) as cursor:
+            for oid, polyline in cursor:
+                i = route_index.get(oid)
+                if i is None or polyline is None:
+                    continue
+                route_measures = measures[offsets[i]:offsets[i + 1]]
+                if np.isnan(route_measures).any():
+                    # Fewer than two points at distinct spots on the route (points
+                    # snapped to the same spot count once); its measures are left as they were
+                    skipped += 1
+                    continue
+                route_measures = route_measures.tolist()
+                cursor.updateRow([oid, update_geometry_with_measures(polyline, route_measures)])
+                progress.route(oid, route_measures[0], route_measures[-1], route_measures)
+        progress.finish()
+        if skipped:
+            arcpy.AddWarning(f'{skipped} routes had fewer than two distinct calibration points and were not changed')
         return
@@ -0,0 +1,486 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Vectorized measure calibration. Routes are passed as one contiguous (n, 2)
+# array of vertex coordinates plus an offsets array where route i spans
+# xy[offsets[i]:offsets[i + 1]], so a whole network is calibrated in a few
+# array operations instead of one Python call per vertex. Multipart routes
+# add part offsets into the same vertex array; measures run on across parts
+# and the gap between two parts adds no length. No arcpy needed.
+
+
+def route_offsets(vertex_counts):
+    """Offsets array for routes with the given vertex counts."""
+    offsets = np.zeros(len(vertex_counts) + 1, dtype=np.int64)
+    np.cumsum(vertex_counts, out=offsets[1:])
+    return offsets
+
+
+def _wkb_header(blob, pos):
+    """Byte order, base geometry type and coordinate count per vertex at ``pos``."""
+    order = "<" if blob[pos] == 1 else ">"
+    (code,) = struct.unpack_from(order + "I", blob, pos + 1)
+    # EWKB flags Z and M in the high bits, ISO WKB adds 1000/2000/3000
+    dims = 2 + bool(code & 0x80000000) + bool(code & 0x40000000)
+    code &= 0x0FFFFFFF
+    dims += (0, 1, 1, 2)[code // 1000]
+    return order, code % 1000, dims
+
+
+def wkb_lines(blob):
+    """(m, 2) vertex arrays of each part of a LineString or MultiLineString WKB."""
+    order, kind, _ = _wkb_header(blob, 0)
+    if kind == 2:
+        count, pos = 1, 0
+    elif kind == 5:
+        (count,) = struct.unpack_from(order + "I", blob, 5)
+        pos = 9
+    else:
+        raise ValueError(f"Expected a LineString or MultiLineString WKB, got type {kind}")
+    parts = []
+    for _ in range(count):
+        order, _, dims = _wkb_header(blob, pos)
+        (n,) = struct.unpack_from(order + "I", blob, pos + 5)
+        pos += 9
+        part = np.frombuffer(blob, dtype=order + "f8", count=n * dims, offset=pos).reshape(n, dims)
+        parts.append(part[:, :2].astype(np.float64))
+        pos += 8 * n * dims
+    return parts
+
+
+class RouteGeometry:
+    """
+    Many (possibly multipart) routes in flat arrays, laid out like GeoArrow.
+
+    ``xy`` holds every vertex, part j spans ``xy[part_offsets[j]:part_offsets[j + 1]]``
+    and route i owns parts ``route_parts[i]:route_parts[i + 1]``.
+    """
+
+    def __init__(self, xy, part_offsets, route_parts):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.route_parts = np.asarray(route_parts, dtype=np.int64)
+
+    @classmethod
+    def from_parts(cls, routes):
+        """Build from nested sequences: routes -> parts -> (x, y) vertices."""
+        coords, part_counts, parts_per_route = [], [], []
+        for parts in routes:
+            parts_per_route.append(len(parts))
+            for part in parts:
+                part_counts.append(len(part))
+                coords.extend(part)
+        return cls(np.array(coords, dtype=np.float64).reshape(-1, 2),
+                   route_offsets(part_counts), route_offsets(parts_per_route))
+
+    @classmethod
+    def from_counts(cls, xy, part_counts, parts_per_route):
+        return cls(xy, route_offsets(part_counts), route_offsets(parts_per_route))
+
+    @classmethod
+    def from_wkb(cls, blobs):
+        """Build from one LineString or MultiLineString WKB per route; Z, M and empty parts are dropped."""
+        coords, part_counts, parts_per_route = [], [], []
+        for blob in blobs:
+            parts = [part for part in wkb_lines(blob) if len(part)]
+            parts_per_route.append(len(parts))
+            for part in parts:
+                part_counts.append(len(part))
+                coords.append(part)
+        xy = np.concatenate(coords) if coords else np.empty((0, 2))
+        return cls(xy, route_offsets(part_counts), route_offsets(parts_per_route))
+
+    def __len__(self):
+        return len(self.route_parts) - 1
+
+    @property
+    def offsets(self):
+        """Vertex offsets of each route."""
+        return self.part_offsets[self.route_parts]
+
+    def route(self, i):
+        """Vertices of route i as a list of (m, 2) arrays, one per part."""
+        bounds = self.part_offsets[self.route_parts[i]:self.route_parts[i + 1] + 1]
+        return [self.xy[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def cumulative_lengths(xy, offsets=None, part_offsets=None):
+    """
+    Distance along each route at every vertex, restarting at 0 for each route.
+
+    When ``part_offsets`` is given, the jump from the end of one part to the
+    start of the next is not counted.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    if offsets is None:
+        offsets = np.array([0, len(xy)], dtype=np.int64)
+    if len(xy) == 0:
+        return np.zeros(0)
+    steps = np.zeros(len(xy))
+    steps[1:] = np.hypot(*np.diff(xy[:, :2], axis=0).T)
+    # The step into the first vertex of a route comes from the previous route
+    # and the step into the first vertex of a part crosses a gap
+    starts = np.asarray(offsets[:-1])
+    steps[starts[starts < len(xy)]] = 0.0
+    if part_offsets is not None:
+        part_starts = np.asarray(part_offsets[:-1])
+        steps[part_starts[part_starts < len(xy)]] = 0.0
+    cumulative = np.cumsum(steps)
+    counts = np.diff(offsets)
+    base = np.repeat(cumulative[np.minimum(starts, len(xy) - 1)], counts)
+    return cumulative - base
+
+
+def route_lengths(cumulative, offsets):
+    """Total length of every route from its cumulative lengths."""
+    counts = np.diff(offsets)
+    lengths = np.zeros(len(counts))
+    nonempty = counts > 0
+    lengths[nonempty] = cumulative[np.asarray(offsets[1:])[nonempty] - 1]
+    return lengths
+
+
+def calibrate_routes(xy, offsets, from_measures, to_measures, part_offsets=None):
+    """
+    Linearly interpolate M values by distance along each route.
+
+    The first vertex of route i gets from_measures[i], the last gets
+    to_measures[i] and every vertex in between is placed by its share of the
+    route length. Zero-length routes take the from measure throughout.
+    Returns an (n,) array of measures aligned with ``xy``.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    cumulative = cumulative_lengths(xy, offsets, part_offsets)
+    lengths = route_lengths(cumulative, offsets)
+    counts = np.diff(offsets)
+    from_m = np.broadcast_to(np.asarray(from_measures, dtype=np.float64), counts.shape)
+    to_m = np.broadcast_to(np.asarray(to_measures, dtype=np.float64), counts.shape)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.where(lengths > 0, (to_m - from_m) / lengths, 0.0)
+    return np.repeat(from_m, counts) + cumulative * np.repeat(scale, counts)
+
+
+def calibrate_measures(xy, from_measure, to_measure, part_offsets=None):
+    """Calibrate a single route; see ``calibrate_routes``."""
+    xy = np.asarray(xy, dtype=np.float64)
+    return calibrate_routes(xy, [0, len(xy)], [from_measure], [to_measure], part_offsets)
+
+
+def calibrate_geometry(geometry, from_measures, to_measures, workers=1):
+    """Calibrate every route of a ``RouteGeometry``, across all of its parts."""
+    return calibrate_routes_parallel(geometry.xy, geometry.offsets, from_measures, to_measures,
+                                     workers=workers, part_offsets=geometry.part_offsets)
+
+
+class MeasureIndex:
+    """
+    Cumulative-length and measure index for locating positions along routes.
+
+    Lookups binary-search each query's own route, O(log n) per query and
+    vectorized across all queries, and interpolate within the segment found.
+    Measures may run either way along a route but must not reverse within it.
+    """
+
+    def __init__(self, xy, offsets, measures, part_offsets=None):
+        self.xy = np.asarray(xy, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.measures = np.asarray(measures, dtype=np.float64)
+        self.cumulative = cumulative_lengths(self.xy, self.offsets, part_offsets)
+
+    @classmethod
+    def from_geometry(cls, geometry, measures):
+        return cls(geometry.xy, geometry.offsets, measures, geometry.part_offsets)
+
+    def locate_measures(self, routes, values):
+        """XY for measure ``values[k]`` on route ``routes[k]``; see ``_locate``."""
+        return self._locate(self.measures, routes, values)
+
+    def locate_distances(self, routes, values):
+        """XY for a distance from the start of each route; see ``_locate``."""
+        return self._locate(self.cumulative, routes, values)
+
+    def _locate(self, keys, routes, values):
+        """
+        Return ``(xy, segment)``: the interpolated (k, 2) positions and the
+        index of the vertex starting the segment each one falls on. Queries
+        off the end of their route get NaN coordinates and segment -1.
+        """
+        routes = np.asarray(routes, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        first = self.offsets[routes]
+        last = self.offsets[routes + 1] - 1
+        valid = last >= first
+        first_key = keys[np.where(valid, first, 0)]
+        last_key = keys[np.where(valid, last, 0)]
+        # Search decreasing routes on negated keys so every search is ascending
+        sign = np.where(last_key >= first_key, 1.0, -1.0)
+        target = values * sign
+        valid &= (target >= first_key * sign) & (target <= last_key * sign)
+
+        # Largest segment start in [first, last - 1] whose key is <= target
+        lo = first.copy()
+        hi = np.maximum(last - 1, first)
+        active = valid & (lo < hi)
+        while active.any():
+            mid = (lo + hi + 1) // 2
+            go = keys[np.where(active, mid, 0)] * sign <= target
+            lo = np.where(active & go, mid, lo)
+            hi = np.where(active & ~go, mid - 1, hi)
+            active &= lo < hi
+
+        seg = np.where(valid, lo, 0)
+        nxt = np.minimum(seg + 1, len(keys) - 1)
+        span = keys[nxt] - keys[seg]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where((span != 0) & (nxt <= last), (values - keys[seg]) / span, 0.0)
+        t = np.clip(t, 0.0, 1.0)[:, None]
+        xy = self.xy[seg] + t * (self.xy[nxt] - self.xy[seg])
+        xy[~valid] = np.nan
+        return xy, np.where(valid, seg, -1)
+
+
+class SegmentIndex:
+    """
+    Uniform-grid spatial index over the segments of a ``RouteGeometry``.
+
+    Every segment is registered in each grid cell its bounding box touches,
+    stored CSR-style (sorted cell keys plus start offsets), so a query only
+    measures distances to the segments in the cells around each point. The
+    jump between two parts of a route is not a segment.
+    """
+
+    def __init__(self, geometry, cell_size=None, min_cell_size=0.0, max_entries_per_segment=8):
+        self.geometry = geometry
+        xy = geometry.xy
+        n = len(xy)
+        is_segment = np.ones(max(n - 1, 0), dtype=bool)
+        part_ends = geometry.part_offsets[1:] - 1
+        is_segment[part_ends[(part_ends >= 0) & (part_ends < n - 1)]] = False
+        self.segments = np.flatnonzero(is_segment)
+        vertex_route = np.repeat(np.arange(len(geometry)), np.diff(geometry.offsets))
+        self.segment_route = vertex_route[self.segments]
+
+        a, b = xy[self.segments], xy[self.segments + 1]
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        if cell_size is None:
+            extent = (hi - lo).max(axis=1) if len(lo) else np.ones(1)
+            cell_size = max(float(np.median(extent)), min_cell_size) or 1.0
+            # A few long diagonal segments can cover a huge number of small
+            # cells; coarsen the grid until the registrations stay bounded
+            size = hi - lo
+            while (np.prod(size // cell_size + 1, axis=1).sum()
+                   > max_entries_per_segment * max(len(size), 1)):
+                cell_size *= 2
+        self.cell_size = cell_size
+        self.origin = xy.min(axis=0) if n else np.zeros(2)
+        ix0, iy0 = self._cells(lo)
+        ix1, iy1 = self._cells(hi)
+        self._rows = int(iy1.max()) + 2 if len(iy1) else 1
+
+        # One entry per (segment, cell) the segment's box covers
+        widths = ix1 - ix0 + 1
+        heights = iy1 - iy0 + 1
+        per_segment = widths * heights
+        owner = np.repeat(np.arange(len(self.segments)), per_segment)
+        local = np.arange(per_segment.sum()) - np.repeat(np.cumsum(per_segment) - per_segment, per_segment)
+        keys = self._key(ix0[owner] + local % widths[owner], iy0[owner] + local // widths[owner])
+        order = np.argsort(keys, kind="stable")
+        self._entries = owner[order]
+        self._keys, starts = np.unique(keys[order], return_index=True)
+        self._starts = np.append(starts, len(order))
+
+    def _cells(self, xy):
+        cells = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        return cells[:, 0], cells[:, 1]
+
+    def _key(self, ix, iy):
+        return ix * self._rows + iy
+
+    def nearest(self, points, radius, point_keys=None, route_keys=None, chunk=50000):
+        """
+        Snap each point to the closest segment within ``radius``.
+
+        When ``point_keys`` and ``route_keys`` are given, a point only snaps
+        to segments of routes whose key matches its own (e.g. the route ID).
+        Returns ``(route, segment, t, distance)``: the route index, the index
+        of the vertex starting the segment, the position along the segment
+        (0-1) and the snap distance. Unmatched points get route/segment -1.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        count = len(points)
+        route = np.full(count, -1, dtype=np.int64)
+        segment = np.full(count, -1, dtype=np.int64)
+        t_out = np.zeros(count)
+        dist_out = np.full(count, np.inf)
+        reach = int(np.ceil(radius / self.cell_size))
+        window = [(dx, dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)]
+        xy = self.geometry.xy
+
+        for first in range(0, count, chunk):
+            pts = points[first:first + chunk]
+            px, py = self._cells(pts)
+            pairs_p, pairs_s = [], []
+            for dx, dy in window:
+                keys = self._key(px + dx, py + dy)
+                slot = np.searchsorted(self._keys, keys)
+                slot = np.minimum(slot, len(self._keys) - 1)
+                hit = (len(self._keys) > 0) & (self._keys[slot] == keys) & (px + dx >= 0) & (py + dy >= 0)
+                lo, hi = self._starts[slot][hit], self._starts[slot + 1][hit]
+                sizes = hi - lo
+                owners = np.repeat(np.flatnonzero(hit), sizes)
+                offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                pairs_p.append(owners)
+                pairs_s.append(self._entries[np.repeat(lo, sizes) + offsets])
+            p = np.concatenate(pairs_p)
+            s = np.concatenate(pairs_s)
+            if point_keys is not None:
+                match = (np.asarray(route_keys)[self.segment_route[s]]
+                         == np.asarray(point_keys)[first:first + chunk][p])
+                p, s = p[match], s[match]
+            if not len(p):
+                continue
+
+            a = xy[self.segments[s]]
+            ab = xy[self.segments[s] + 1] - a
+            ap = pts[p] - a
+            length2 = (ab * ab).sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                t = np.where(length2 > 0, (ap * ab).sum(axis=1) / length2, 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            d = np.hypot(*(ap - t[:, None] * ab).T)
+            keep = d <= radius
+            p, s, t, d = p[keep], s[keep], t[keep], d[keep]
+
+            # Closest candidate per point: sort by point, then distance, take the first
+            order = np.lexsort((d, p))
+            p, s, t, d = p[order], s[order], t[order], d[order]
+            best = np.ones(len(p), dtype=bool)
+            best[1:] = p[1:] != p[:-1]
+            idx = first + p[best]
+            route[idx] = self.segment_route[s[best]]
+            segment[idx] = self.segments[s[best]]
+            t_out[idx] = t[best]
+            dist_out[idx] = d[best]
+        return route, segment, t_out, dist_out
+
+
+def calibrate_to_anchors(geometry, anchor_routes, anchor_distances, anchor_measures, extrapolate=True):
+    """
+    Piecewise-linear M values from calibration anchors along each route.
+
+    Anchors are (route index, distance along route, measure). Vertices
+    between two anchors are interpolated by distance; vertices before the
+    first or after the last anchor are extrapolated from the nearest pair of
+    anchors, or take that anchor's measure when ``extrapolate`` is False.
+    Routes with fewer than two anchors get NaN. Everything is done in one
+    pass over the network by shifting each route onto its own stretch of a
+    single distance axis.
+    """
+    offsets = geometry.offsets
+    counts = np.diff(offsets)
+    n_routes = len(counts)
+    cumulative = cumulative_lengths(geometry.xy, offsets, geometry.part_offsets)
+    lengths = route_lengths(cumulative, offsets)
+    shift = np.zeros(n_routes)
+    shift[1:] = np.cumsum(lengths + 1.0)[:-1]
+    vertex_route = np.repeat(np.arange(n_routes), counts)
+
+    anchor_routes = np.asarray(anchor_routes, dtype=np.int64)
+    anchor_distances = np.asarray(anchor_distances, dtype=np.float64)
+    anchor_measures = np.asarray(anchor_measures, dtype=np.float64)
+    order = np.lexsort((anchor_distances, anchor_routes))
+    a_route, a_dist, a_m = anchor_routes[order], anchor_distances[order], anchor_measures[order]
+    # Two anchors at the same spot cannot define a slope; keep the first
+    unique = np.ones(len(a_route), dtype=bool)
+    unique[1:] = (a_route[1:] != a_route[:-1]) | (a_dist[1:] != a_dist[:-1])
+    a_route, a_dist, a_m = a_route[unique], a_dist[unique], a_m[unique]
+    per_route = np.bincount(a_route, minlength=n_routes)
+    a_start = np.zeros(n_routes, dtype=np.int64)
+    a_start[1:] = np.cumsum(per_route)[:-1]
+    a_key = a_dist + shift[a_route]
+
+    measures = np.full(len(cumulative), np.nan)
+    calibrated = per_route[vertex_route] >= 2
+    v_route = vertex_route[calibrated]
+    v_key = cumulative[calibrated] + shift[v_route]
+    # Left anchor of the pair each vertex is interpolated (or extrapolated) from
+    j = np.searchsorted(a_key, v_key, side="right") - 1
+    j = np.clip(j, a_start[v_route], a_start[v_route] + per_route[v_route] - 2)
+    t = (v_key - a_key[j]) / (a_key[j + 1] - a_key[j])
+    if not extrapolate:
+        t = np.clip(t, 0.0, 1.0)
+    measures[calibrated] = a_m[j] + t * (a_m[j + 1] - a_m[j])
+    return measures
+
+
+def snap_anchors(geometry, points, radius, point_keys=None, route_keys=None, index=None):
+    """
+    Snap calibration points to their routes.
+
+    Returns ``(route, distance_along, snap_distance)``; points with no route
+    segment within ``radius`` get route -1.
+    """
+    index = index or SegmentIndex(geometry, min_cell_size=radius)
+    route, segment, t, snap_distance = index.nearest(points, radius, point_keys, route_keys)
+    cumulative = cumulative_lengths(geometry.xy, geometry.offsets, geometry.part_offsets)
+    found = segment >= 0
+    along = np.full(len(route), np.nan)
+    seg = segment[found]
+    along[found] = cumulative[seg] + t[found] * (cumulative[seg + 1] - cumulative[seg])
+    return route, along, snap_distance
+
+
+def partition_routes(offsets, parts):
+    """Split routes into up to ``parts`` contiguous groups of about equal vertex count."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_routes = len(offsets) - 1
+    targets = np.linspace(0, offsets[-1], parts + 1)[1:-1]
+    cuts = np.searchsorted(offsets, targets)
+    bounds = np.unique(np.concatenate([[0], np.clip(cuts, 0, n_routes), [n_routes]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _calibrate_group(task):
+    xy, offsets, from_measures, to_measures, part_offsets = task
+    return calibrate_routes(xy, offsets, from_measures, to_measures, part_offsets)
+
+
+def calibrate_routes_parallel(xy, offsets, from_measures, to_measures, workers=None, groups_per_worker=4,
+                              part_offsets=None):
+    """
+    ``calibrate_routes`` spread over a process pool.
+
+    Routes are split into contiguous groups balanced by vertex count, each
+    group is calibrated in a worker process and the results are joined back
+    in group order, so the output is aligned with ``xy`` and repeatable
+    whatever order the workers finish in.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_routes = len(offsets) - 1
+    from_m = np.broadcast_to(np.asarray(from_measures, dtype=np.float64), (n_routes,))
+    to_m = np.broadcast_to(np.asarray(to_measures, dtype=np.float64), (n_routes,))
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or n_routes < 2:
+        return calibrate_routes(xy, offsets, from_m, to_m, part_offsets)
+    if part_offsets is not None:
+        part_offsets = np.asarray(part_offsets, dtype=np.int64)
+
+    def tasks():
+        for lo, hi in partition_routes(offsets, workers * groups_per_worker):
+            start, end = offsets[lo], offsets[hi]
+            parts = None
+            if part_offsets is not None:
+                # Parts never straddle routes, so the group's parts are a contiguous run
+                a, b = np.searchsorted(part_offsets, [start, end])
+                parts = part_offsets[a:b + 1] - start
+            yield xy[start:end], offsets[lo:hi + 1] - start, from_m[lo:hi], to_m[lo:hi], parts
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() yields in submission order regardless of completion order
+        results = list(pool.map(_calibrate_group, tasks()))
+    return np.concatenate(results) if results else np.zeros(0)
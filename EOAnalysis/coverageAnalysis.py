@@ -0,0 +1,193 @@
+import os
+import sys
+import csv
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Multi-transmitter coverage on a DEM grid. Every transmitter is only
+# evaluated in the tiles its maximum useful radius reaches, each tile folds
+# its transmitters into running best-server / max-signal / overlap-count
+# arrays one at a time, and tiles run in parallel worker processes while
+# the main process writes finished tiles in order.
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pathLoss import NODATA, _rasterio, block_windows, cell_centers, hata_coefficients, path_loss
+
+# Best-server NoData: no transmitter reaches the cell
+NO_SERVER = -1
+
+
+class Transmitters:
+    """
+    A table of transmitters with their model coefficients worked out once.
+
+    ``a`` and ``b`` are the Hata terms (path loss ``a + b * log10(d_km)``)
+    and ``radius_km`` is how far out each transmitter still delivers
+    ``sensitivity_dbm``, found by inverting the model, optionally capped by
+    ``max_radius_km``.
+    """
+
+    def __init__(self, names, x, y, frequency, ht, hr, environment, eirp_dbm,
+                 sensitivity_dbm=-100.0, max_radius_km=None):
+        self.names = list(names)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.eirp_dbm = np.asarray(eirp_dbm, dtype=np.float64)
+        self.sensitivity_dbm = sensitivity_dbm
+        coefficients = [hata_coefficients(f, t, r, env)
+                        for f, t, r, env in zip(frequency, ht, hr, environment)]
+        self.a = np.array([c[0] for c in coefficients], dtype=np.float64).reshape(-1)
+        self.b = np.array([c[1] for c in coefficients], dtype=np.float64).reshape(-1)
+        self.radius_km = max_radius(self.a, self.b, self.eirp_dbm - sensitivity_dbm)
+        if max_radius_km is not None:
+            self.radius_km = np.minimum(self.radius_km, max_radius_km)
+
+    @classmethod
+    def from_csv(cls, path, sensitivity_dbm=-100.0, max_radius_km=None):
+        """Read ``name, x, y, frequency, ht, hr, environment, eirp_dbm`` columns."""
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        return cls([r['name'] for r in rows],
+                   [float(r['x']) for r in rows],
+                   [float(r['y']) for r in rows],
+                   [float(r['frequency']) for r in rows],
+                   [float(r['ht']) for r in rows],
+                   [float(r['hr']) for r in rows],
+                   [r['environment'].strip().lower() or 'urban' for r in rows],
+                   [float(r['eirp_dbm']) for r in rows],
+                   sensitivity_dbm, max_radius_km)
+
+    def __len__(self):
+        return len(self.x)
+
+    def reaching(self, xmin, ymin, xmax, ymax, units_per_km=1000.0):
+        """Indexes of transmitters whose radius reaches the box."""
+        dx = np.maximum(np.maximum(xmin - self.x, self.x - xmax), 0.0)
+        dy = np.maximum(np.maximum(ymin - self.y, self.y - ymax), 0.0)
+        return np.flatnonzero(np.hypot(dx, dy) <= self.radius_km * units_per_km)
+
+
+def max_radius(a, b, max_loss):
+    """Distance in km at which the path loss reaches ``max_loss`` (inverse Hata)."""
+    return 10.0 ** ((np.asarray(max_loss, dtype=np.float64) - a) / b)
+
+
+def coverage_block(transmitters, cx, cy, valid=None, units_per_km=1000.0):
+    """
+    Best server, max signal (dBm) and overlap count for one block of cells.
+
+    ``cx``/``cy`` are the cell centre coordinates. Transmitters are folded
+    in one at a time, so memory stays at a few block-sized arrays however
+    many transmitters reach the block. Ties go to the earlier transmitter.
+    """
+    shape = np.broadcast(cx, cy).shape
+    best = np.full(shape, NO_SERVER, dtype=np.int32)
+    signal = np.full(shape, -np.inf)
+    count = np.zeros(shape, dtype=np.uint16)
+    for i in transmitters.reaching(cx.min(), cy.min(), cx.max(), cy.max(), units_per_km).tolist():
+        # The model is only run on the cells inside the radius
+        d2 = (cx - transmitters.x[i]) ** 2 + (cy - transmitters.y[i]) ** 2
+        inside = d2 <= (transmitters.radius_km[i] * units_per_km) ** 2
+        if valid is not None:
+            inside &= valid
+        cells = np.flatnonzero(inside)
+        received = transmitters.eirp_dbm[i] - path_loss(np.sqrt(d2.flat[cells]) / units_per_km,
+                                                         transmitters.a[i], transmitters.b[i])
+        covered = received >= transmitters.sensitivity_dbm
+        cells, received = cells[covered], received[covered]
+        count.flat[cells] += 1
+        stronger = received > signal.flat[cells]
+        best.flat[cells[stronger]] = i
+        signal.flat[cells[stronger]] = received[stronger]
+    return best, np.where(best >= 0, signal, NODATA).astype(np.float32), count
+
+
+def _coverage_tile(task):
+    dem_path, transmitters, row_off, col_off, rows, cols, units_per_km = task
+    rasterio, Window = _rasterio()
+    with rasterio.open(dem_path) as src:
+        valid = src.read_masks(1, window=Window(col_off, row_off, cols, rows)) > 0
+        cx, cy = cell_centers(src.transform, row_off, col_off, rows, cols)
+    cx, cy = np.broadcast_arrays(cx, cy)
+    return coverage_block(transmitters, cx, cy, valid, units_per_km)
+
+
+def _run_tiles(tasks, workers):
+    """
+    Yield ``_coverage_tile`` results in task order.
+
+    At most two tiles per worker are in flight, so finished tiles waiting
+    to be written never pile up in memory.
+    """
+    if workers <= 1:
+        yield from map(_coverage_tile, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(_coverage_tile, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def coverage_rasters(dem_path, transmitters, out_best, out_signal, out_count,
+                     block_size=1024, workers=None, units_per_km=1000.0):
+    """
+    Write best-server, max-signal and overlap-count GeoTIFFs on the DEM's grid.
+
+    Tiles are computed in a process pool and written in tile order as they
+    come back, so only a few tiles are in memory at once. Best server is
+    the transmitter's row in the table (-1 where none reaches), max signal
+    is in dBm and overlap count is how many transmitters deliver at least
+    the sensitivity. Returns the three output paths.
+    """
+    rasterio, Window = _rasterio()
+    workers = workers or os.cpu_count() or 1
+    with rasterio.open(dem_path) as src:
+        profile = src.profile.copy()
+        windows = list(block_windows(src.width, src.height, block_size))
+    profile.update(driver='GTiff', count=1, tiled=True, blockxsize=256, blockysize=256,
+                   compress='deflate', BIGTIFF='IF_SAFER')
+    tasks = ((dem_path, transmitters, row_off, col_off, rows, cols, units_per_km)
+             for row_off, col_off, rows, cols in windows)
+
+    with rasterio.open(out_best, 'w', **dict(profile, dtype='int32', nodata=NO_SERVER)) as best_dst, \
+         rasterio.open(out_signal, 'w', **dict(profile, dtype='float32', nodata=NODATA)) as signal_dst, \
+         rasterio.open(out_count, 'w', **dict(profile, dtype='uint16', nodata=None)) as count_dst:
+        for (row_off, col_off, rows, cols), (best, signal, count) in zip(windows, _run_tiles(tasks, workers)):
+            window = Window(col_off, row_off, cols, rows)
+            best_dst.write(best, 1, window=window)
+            signal_dst.write(signal, 1, window=window)
+            count_dst.write(count, 1, window=window)
+    return out_best, out_signal, out_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Best-server, max-signal and overlap-count rasters for many transmitters.")
+    parser.add_argument("dem", help="DEM GeoTIFF that defines the output grid")
+    parser.add_argument("transmitters", help="CSV with name, x, y, frequency, ht, hr, environment, eirp_dbm")
+    parser.add_argument("out_dir", help="Folder for best_server.tif, max_signal.tif and overlap_count.tif")
+    parser.add_argument("--sensitivity", type=float, default=-100.0, help="Receiver sensitivity in dBm (default -100)")
+    parser.add_argument("--max-radius", type=float, default=None, help="Cap on each transmitter's radius in km")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--block-size", type=int, default=1024, help="Tile size in cells (default 1024)")
+    parser.add_argument("--units-per-km", type=float, default=1000.0, help="Map units per km (default 1000)")
+    args = parser.parse_args()
+
+    transmitters = Transmitters.from_csv(args.transmitters, args.sensitivity, args.max_radius)
+    os.makedirs(args.out_dir, exist_ok=True)
+    outputs = coverage_rasters(args.dem, transmitters,
+                               os.path.join(args.out_dir, "best_server.tif"),
+                               os.path.join(args.out_dir, "max_signal.tif"),
+                               os.path.join(args.out_dir, "overlap_count.tif"),
+                               args.block_size, args.workers, args.units_per_km)
+    print(f"Coverage for {len(transmitters)} transmitters saved at {', '.join(outputs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import os
+import hashlib
+
+import numpy as np
+
+# Vectorized Hata-Okumura path loss. For a given frequency, antenna heights
+# and environment the model is L = A + B * log10(d), so A and B are worked
+# out once and a whole block of distances costs one log10 and a multiply-add.
+# Parameter sweeps broadcast A and B over every combination against one
+# log10(d), and common configurations can be cached as distance LUTs.
+# Rasters are read and written window by window so DEMs much larger than
+# memory can be processed. Only NumPy is needed for the model; GeoTIFF I/O
+# needs rasterio, which is imported when it is first used. No arcpy needed.
+
+ENVIRONMENTS = ('urban', 'suburban', 'rural')
+
+# Hata is fitted from 1 km out; closer cells are clamped so the antenna's own
+# cell does not get log10(0)
+MIN_DISTANCE_KM = 0.01
+
+NODATA = -9999.0
+
+
+def _rasterio():
+    try:
+        import rasterio
+        from rasterio.windows import Window
+    except ImportError as e:
+        raise ImportError("GeoTIFF I/O needs rasterio: pip install rasterio") from e
+    return rasterio, Window
+
+
+def correction_factor(frequency, hr):
+    """Mobile antenna height correction a(hr) for a small/medium city."""
+    return (1.1 * np.log10(frequency) - 0.7) * hr - (1.56 * np.log10(frequency) - 0.8)
+
+
+def hata_coefficients(frequency, ht, hr, environment='urban'):
+    """
+    ``(A, B)`` with path loss ``A + B * log10(distance_km)`` in dB.
+
+    Everything that does not depend on distance is folded into A and B.
+    """
+    if environment not in ENVIRONMENTS:
+        raise ValueError("Environment must be 'urban', 'suburban', or 'rural'")
+    log_f = np.log10(frequency)
+    log_ht = np.log10(ht)
+    a = 69.55 + 26.16 * log_f - 13.82 * log_ht - correction_factor(frequency, hr)
+    b = 44.9 - 6.55 * log_ht
+    if environment == 'suburban':
+        a = a - 2 * np.log10(frequency / 28) ** 2 - 5.4
+    elif environment == 'rural':
+        a = a - 4.78 * log_f ** 2 + 18.33 * log_f - 40.94
+    return a, b
+
+
+def path_loss(distance_km, a, b, min_distance_km=MIN_DISTANCE_KM):
+    """Path loss in dB for an array of distances in km."""
+    distance_km = np.maximum(np.asarray(distance_km, dtype=np.float64), min_distance_km)
+    return a + b * np.log10(distance_km)
+
+
+def hata_okumura_loss(frequency, ht, hr, distance_km, environment='urban'):
+    """Vectorized ``hata_okumura_model``: path loss for an array of distances in km."""
+    return path_loss(distance_km, *hata_coefficients(frequency, ht, hr, environment))
+
+
+def sweep_coefficients(frequencies, hts, hrs, environments=('urban',)):
+    """
+    ``(A, B)`` for every combination of the parameter lists.
+
+    Both have shape ``(environments, frequencies, hts, hrs)``; index them in
+    that order to find a configuration.
+    """
+    f = np.asarray(frequencies, dtype=np.float64).reshape(1, -1, 1, 1)
+    t = np.asarray(hts, dtype=np.float64).reshape(1, 1, -1, 1)
+    r = np.asarray(hrs, dtype=np.float64).reshape(1, 1, 1, -1)
+    shape = (1, f.shape[1], t.shape[2], r.shape[3])
+    coefficients = [hata_coefficients(f, t, r, environment) for environment in environments]
+    a = np.concatenate([np.broadcast_to(c[0], shape) for c in coefficients])
+    b = np.concatenate([np.broadcast_to(c[1], shape) for c in coefficients])
+    return a, b
+
+
+def sweep(frequencies, hts, hrs, environments, distance_km, min_distance_km=MIN_DISTANCE_KM):
+    """
+    Path loss for the Cartesian product of parameters and distances in one pass.
+
+    Returns shape ``(environments, frequencies, hts, hrs) + distance_km.shape``.
+    ``log10(distance)`` is taken once and shared by every configuration, so a
+    1,000-configuration sweep over a distance block is one broadcast
+    multiply-add. Keep ``configurations x distances`` within memory; sweep a
+    raster block by block.
+    """
+    a, b = sweep_coefficients(frequencies, hts, hrs, environments)
+    log_d = np.log10(np.maximum(np.asarray(distance_km, dtype=np.float64), min_distance_km))
+    expand = (Ellipsis,) + (None,) * log_d.ndim
+    return a[expand] + b[expand] * log_d
+
+
+class PathLossLUT:
+    """
+    Path loss for one configuration, binned by distance.
+
+    Bins are evenly spaced in ``log10(distance)`` and lookups interpolate
+    linearly between them, which is exact for Hata (linear in log distance)
+    and leaves room for models that are not. Distances outside
+    ``[d_min_km, d_max_km]`` are clamped to the ends.
+    """
+
+    def __init__(self, log_distance, loss):
+        self.log_distance = np.asarray(log_distance, dtype=np.float64)
+        self.loss = np.asarray(loss, dtype=np.float64)
+
+    @classmethod
+    def build(cls, frequency, ht, hr, environment='urban', d_min_km=MIN_DISTANCE_KM, d_max_km=100.0, bins=512):
+        log_distance = np.linspace(np.log10(d_min_km), np.log10(d_max_km), bins)
+        a, b = hata_coefficients(frequency, ht, hr, environment)
+        return cls(log_distance, a + b * log_distance)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['log_distance'], data['loss'])
+
+    def save(self, path):
+        np.savez(path, log_distance=self.log_distance, loss=self.loss)
+        return path
+
+    def __call__(self, distance_km):
+        log_d = np.log10(np.maximum(np.asarray(distance_km, dtype=np.float64), 10 ** self.log_distance[0]))
+        return np.interp(log_d, self.log_distance, self.loss)
+
+
+_LUTS = {}
+
+
+def lookup_table(frequency, ht, hr, environment='urban', cache_dir=None, d_min_km=MIN_DISTANCE_KM,
+                 d_max_km=100.0, bins=512):
+    """
+    Memoized ``PathLossLUT`` for a configuration.
+
+    Tables are kept in memory for the life of the process and, with
+    ``cache_dir``, saved there as ``.npz`` files named after a hash of the
+    configuration, so later runs load them instead of rebuilding.
+    """
+    key = (round(float(frequency), 6), round(float(ht), 6), round(float(hr), 6), environment,
+           float(d_min_km), float(d_max_km), int(bins))
+    table = _LUTS.get(key)
+    if table is not None:
+        return table
+    path = None
+    if cache_dir:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"hata_{digest}.npz")
+    if path and os.path.exists(path):
+        table = PathLossLUT.load(path)
+    else:
+        table = PathLossLUT.build(frequency, ht, hr, environment, d_min_km, d_max_km, bins)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.save(path)
+    _LUTS[key] = table
+    return table
+
+
+def block_windows(width, height, block_size=1024):
+    """``(row_off, col_off, rows, cols)`` for every block of a width x height raster."""
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield (row_off, col_off,
+                   min(block_size, height - row_off), min(block_size, width - col_off))
+
+
+def cell_centers(transform, row_off, col_off, rows, cols):
+    """
+    Map X and Y of every cell centre in a block.
+
+    ``transform`` is an affine transform with ``a, b, c, d, e, f`` as used by
+    rasterio: ``x = a * col + b * row + c`` and ``y = d * col + e * row + f``.
+    """
+    a, b, c, d, e, f = (transform.a, transform.b, transform.c,
+                        transform.d, transform.e, transform.f) if hasattr(transform, 'a') else transform[:6]
+    cols_ = np.arange(col_off, col_off + cols, dtype=np.float64) + 0.5
+    rows_ = np.arange(row_off, row_off + rows, dtype=np.float64)[:, None] + 0.5
+    return a * cols_ + b * rows_ + c, d * cols_ + e * rows_ + f
+
+
+def cell_distances(transform, row_off, col_off, rows, cols, x, y):
+    """Distance in map units from (x, y) to every cell centre in a block."""
+    cx, cy = cell_centers(transform, row_off, col_off, rows, cols)
+    return np.hypot(cx - x, cy - y)
+
+
+def path_loss_raster(dem_path, out_path, antenna_xy, frequency, ht, hr, environment='urban',
+                     block_size=1024, units_per_km=1000.0):
+    """
+    Write a Hata-Okumura path loss GeoTIFF on the DEM's grid.
+
+    The DEM is read one window at a time, only for its NoData mask, and
+    distances come from the grid's affine transform, so no distance raster
+    is built. ``units_per_km`` converts map units to km (1000 for metres).
+    Returns the output path.
+    """
+    rasterio, Window = _rasterio()
+    a, b = hata_coefficients(frequency, ht, hr, environment)
+    x, y = antenna_xy
+    with rasterio.open(dem_path) as src:
+        profile = src.profile.copy()
+        profile.update(driver='GTiff', dtype='float32', count=1, nodata=NODATA, tiled=True,
+                       blockxsize=256, blockysize=256, compress='deflate', BIGTIFF='IF_SAFER')
+        with rasterio.open(out_path, 'w', **profile) as dst:
+            for row_off, col_off, rows, cols in block_windows(src.width, src.height, block_size):
+                window = Window(col_off, row_off, cols, rows)
+                valid = src.read_masks(1, window=window) > 0
+                distance = cell_distances(src.transform, row_off, col_off, rows, cols, x, y)
+                loss = path_loss(distance / units_per_km, a, b)
+                dst.write(np.where(valid, loss, NODATA).astype(np.float32), 1, window=window)
+    return out_path
+
+
+def sweep_coverage(dem_path, antenna_xy, frequencies, hts, hrs, environments, max_loss_db,
+                   block_size=1024, units_per_km=1000.0):
+    """
+    Share of DEM cells within ``max_loss_db`` for every parameter combination.
+
+    One windowed pass over the DEM serves the whole sweep. Hata loss only
+    grows with distance, so a configuration covers exactly the cells closer
+    than its inverse-Hata radius; each block's distances are sorted once and
+    every configuration is counted with a single ``searchsorted``. Returns
+    an array shaped ``(environments, frequencies, hts, hrs)``.
+    """
+    rasterio, Window = _rasterio()
+    a, b = sweep_coefficients(frequencies, hts, hrs, environments)
+    radius = 10.0 ** ((max_loss_db - a) / b) * units_per_km
+    covered = np.zeros(a.shape, dtype=np.int64)
+    total = 0
+    x, y = antenna_xy
+    with rasterio.open(dem_path) as src:
+        for row_off, col_off, rows, cols in block_windows(src.width, src.height, block_size):
+            valid = src.read_masks(1, window=Window(col_off, row_off, cols, rows)) > 0
+            distance = np.sort(cell_distances(src.transform, row_off, col_off, rows, cols, x, y)[valid])
+            # Cells inside the minimum distance get that distance's loss
+            distance = np.maximum(distance, MIN_DISTANCE_KM * units_per_km)
+            covered += np.searchsorted(distance, radius, side='right')
+            total += distance.size
+    return covered / max(total, 1)
@@ -1,6 +1,11 @@
 import math
-import arcpy
-from arcpy.sa import *
+import os
+import sys
+
+# The vectorized path loss engine lives next to this script and has no arcpy dependency
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pathLoss import path_loss_raster
+from terrainLoss import terrain_loss_raster
 
 def hata_okumura_model(frequency, ht, hr, distance, environment='urban'):
     def correction_factor(frequency, hr):
@@ -27,40 +32,36 @@ ht = 30  # Transmitting antenna height in meters
 hr = 1.5  # Receiving antenna height in meters
 environment = 'urban'  # Environment type
 
-# Path to the input DEM
+# Path to the input DEM (GeoTIFF)
 dem_path = "path/to/your/dem.tif"
 
 # Coordinates of the antenna location (replace with actual coordinates)
-antenna_location = (x, y)  # Replace with actual coordinates of the antenna
+antenna_location = (x, y)  # Replace with actual coordinates of the antenna, in the DEM's coordinate system
 
 # Path to the output raster
 out_raster_path = "path/to/output/path_loss.tif"
 
-# Set environment settings
-arcpy.env.workspace = "path/to/your/workspace"
-arcpy.env.overwriteOutput = True
-
-# Load DEM
-dem = Raster(dem_path)
+# Map units per kilometre (1000 for a DEM in metres)
+units_per_km = 1000.0
 
-# Calculate distance from each pixel to the antenna location
-distance_raster = EucDistance(dem, SourceData=antenna_location)
+# Rows/columns read and written at a time; lower it if memory is tight
+block_size = 1024
 
-# Apply Hata-Okumura model
-def apply_hata_okumura_model(distance_raster, frequency, ht, hr, environment):
-    out_raster = Raster(distance_raster)
-    with arcpy.da.UpdateCursor(out_raster, ["VALUE"]) as cursor:
-        for row in cursor:
-            distance = row[0] / 1000  # Convert distance to kilometers
-            path_loss = hata_okumura_model(frequency, ht, hr, distance, environment)
-            row[0] = path_loss
-            cursor.updateRow(row)
-    return out_raster
+# Generate path loss raster. Distances to the antenna are computed per block
+# from the DEM's geotransform, so no distance raster is built, and the model
+# runs on each block as one array operation
+path_loss_raster(dem_path, out_raster_path, antenna_location, frequency, ht, hr, environment,
+                 block_size=block_size, units_per_km=units_per_km)
 
-# Generate path loss raster
-path_loss_raster = apply_hata_okumura_model(distance_raster, frequency, ht, hr, environment)
+print(f"Path loss raster saved at {out_raster_path}")
 
-# Save the result
-path_loss_raster.save(out_raster_path)
+# Optional terrain stage: Hata path loss plus knife-edge loss behind hills,
+# within terrain_radius_km of the antenna. Set to None to skip
+terrain_radius_km = 20
+terrain_raster_path = "path/to/output/path_loss_terrain.tif"
+los_raster_path = "path/to/output/line_of_sight.tif"
 
-print(f"Path loss raster saved at {out_raster_path}")
+if terrain_radius_km:
+    terrain_loss_raster(dem_path, terrain_raster_path, antenna_location, frequency, ht, hr, terrain_radius_km,
+                        environment=environment, los_path=los_raster_path, units_per_km=units_per_km)
+    print(f"Terrain path loss raster saved at {terrain_raster_path}")
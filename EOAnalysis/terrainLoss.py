@@ -0,0 +1,209 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Terrain obstruction loss by radial sweep. Rays are cast from the antenna
+# one cell apart along their length and DEM heights are sampled once per
+# ray; a running maximum of the elevation angle along each ray
+# (np.maximum.accumulate) gives every sample its horizon, so all cells on a
+# ray are answered from the same profile instead of re-sampling a fresh
+# line of sight per cell. Blocked cells get single knife-edge diffraction
+# loss J(v) from the horizon obstacle; cells in line of sight get 0 dB.
+# Rays are split into angular sectors that run in worker processes.
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pathLoss import NODATA, _rasterio, cell_distances, hata_coefficients, path_loss
+
+EARTH_RADIUS_M = 6371000.0
+
+# Effective earth radius factor for standard atmospheric refraction
+K_FACTOR = 4.0 / 3.0
+
+# Rays per sector handed to a worker
+RAYS_PER_TASK = 256
+
+
+def knife_edge_loss(v):
+    """Single knife-edge diffraction loss J(v) in dB (ITU-R P.526 approximation)."""
+    v = np.asarray(v, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        loss = 6.9 + 20 * np.log10(np.sqrt((v - 0.1) ** 2 + 1) + v - 0.1)
+    return np.where(v > -0.78, loss, 0.0)
+
+
+def ray_angles(radius_cells, oversample=1.5):
+    """Ray bearings so neighbouring rays are at most 1/oversample cells apart at the radius."""
+    n_rays = max(int(np.ceil(2 * np.pi * radius_cells * oversample)), 8)
+    return np.arange(n_rays) * (2 * np.pi / n_rays)
+
+
+_DEM = None
+
+
+def _init_worker(dem):
+    global _DEM
+    _DEM = dem
+
+
+def sweep_rays(dem, row, col, angles, radius_cells, cell_m, frequency, ht, hr,
+               earth_curvature=True, nodata=None):
+    """
+    Profile a batch of rays and return ``(cells, loss_db, visible)``.
+
+    ``cells`` are flat DEM indexes of every ray sample, ``loss_db`` the
+    knife-edge loss there and ``visible`` whether the receiver at that
+    sample sees the antenna. A cell hit by several rays appears several
+    times; callers keep the smallest loss.
+    """
+    height, width = dem.shape
+    # Step one whole cell along each ray's major axis so no row or column is
+    # skipped; neighbouring rays then cover the minor axis
+    dy, dx = -np.sin(angles), np.cos(angles)
+    major = np.maximum(np.abs(dx), np.abs(dy))[:, None]
+    steps = np.arange(1, int(np.ceil(radius_cells)) + 1, dtype=np.float64)
+    along = steps / major
+    r = np.rint(row + dy[:, None] * along).astype(np.int64)
+    c = np.rint(col + dx[:, None] * along).astype(np.int64)
+    inside = (r >= 0) & (r < height) & (c >= 0) & (c < width) & (along <= radius_cells)
+    z = dem[np.clip(r, 0, height - 1), np.clip(c, 0, width - 1)].astype(np.float64)
+    ground = inside & np.isfinite(z)
+    if nodata is not None:
+        ground &= z != nodata
+
+    distance = along * cell_m
+    if earth_curvature:
+        z = z - distance ** 2 / (2 * K_FACTOR * EARTH_RADIUS_M)
+    z_tx = float(dem[row, col]) + ht
+    # Elevation angle (as a slope) of the ground and of the receiver at each sample
+    ground_slope = np.where(ground, (z - z_tx) / distance, -np.inf)
+    rx_slope = (z + hr - z_tx) / distance
+
+    # Horizon seen from the antenna before each sample, and where it is
+    running = np.maximum.accumulate(ground_slope, axis=1)
+    index = np.broadcast_to(np.arange(len(steps)), running.shape)
+    running_at = np.maximum.accumulate(np.where(ground_slope >= running, index, 0), axis=1)
+    horizon = np.full(running.shape, -np.inf)
+    horizon[:, 1:] = running[:, :-1]
+    horizon_at = np.zeros(running.shape, dtype=np.int64)
+    horizon_at[:, 1:] = running_at[:, :-1]
+
+    visible = rx_slope >= horizon
+    # Height of the horizon obstacle above the direct antenna-receiver line
+    d1 = np.take_along_axis(distance, horizon_at, axis=1)
+    d2 = distance - d1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        clearance = d1 * (horizon - rx_slope)
+        v = clearance * np.sqrt(2 * distance / ((299.792458 / frequency) * d1 * d2))
+    # Hata's empirical fit already covers average ground and clutter, so only
+    # cells that are actually blocked get diffraction loss on top
+    loss = np.where(visible | ~np.isfinite(horizon), 0.0, knife_edge_loss(v))
+
+    keep = ground
+    return (r[keep] * width + c[keep]), loss[keep], visible[keep]
+
+
+def _sweep_task(task):
+    row, col, angles, radius_cells, cell_m, frequency, ht, hr, earth_curvature, nodata = task
+    return sweep_rays(_DEM, row, col, angles, radius_cells, cell_m, frequency, ht, hr, earth_curvature, nodata)
+
+
+def terrain_loss(dem, row, col, cell_m, frequency, ht, hr, radius_cells=None, workers=1,
+                 oversample=1.5, earth_curvature=True, nodata=None):
+    """
+    Knife-edge terrain loss (dB) and line-of-sight mask for every DEM cell.
+
+    ``row``/``col`` is the antenna cell and ``cell_m`` the cell size in
+    metres. Cells beyond ``radius_cells`` or on NoData get NaN loss. Sectors
+    of ``RAYS_PER_TASK`` rays run in ``workers`` processes, each holding
+    one copy of the DEM, and are reduced into the grid as they finish.
+    """
+    dem = np.asarray(dem)
+    height, width = dem.shape
+    if radius_cells is None:
+        radius_cells = np.hypot(max(row, height - 1 - row), max(col, width - 1 - col))
+    angles = ray_angles(radius_cells, oversample)
+    sectors = [angles[i:i + RAYS_PER_TASK] for i in range(0, len(angles), RAYS_PER_TASK)]
+    tasks = [(row, col, sector, radius_cells, cell_m, frequency, ht, hr, earth_curvature, nodata)
+             for sector in sectors]
+
+    loss = np.full(height * width, np.inf)
+    visible = np.zeros(height * width, dtype=np.uint8)
+
+    def reduce(result):
+        cells, sector_loss, sector_visible = result
+        np.minimum.at(loss, cells, sector_loss)
+        np.maximum.at(visible, cells, sector_visible.astype(np.uint8))
+
+    if workers <= 1:
+        _init_worker(dem)
+        for task in tasks:
+            reduce(_sweep_task(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dem,)) as pool:
+            for result in pool.map(_sweep_task, tasks):
+                reduce(result)
+
+    loss = loss.reshape(height, width)
+    loss[np.isinf(loss)] = np.nan
+    loss[row, col] = 0.0
+    visible = visible.reshape(height, width).astype(bool)
+    visible[row, col] = True
+    return loss, visible
+
+
+def terrain_loss_raster(dem_path, out_path, antenna_xy, frequency, ht, hr, radius_km,
+                        environment=None, los_path=None, workers=None, units_per_km=1000.0,
+                        earth_curvature=True):
+    """
+    Write terrain loss for the square of DEM within ``radius_km`` of the antenna.
+
+    Only that window of the DEM is read. With ``environment`` the output is
+    the Hata path loss plus the terrain loss; otherwise it is the terrain
+    loss alone. ``los_path`` optionally receives a 1/0 line-of-sight
+    raster. The grid must be north-up with square cells. Returns the output
+    path.
+    """
+    rasterio, Window = _rasterio()
+    workers = workers or os.cpu_count() or 1
+    x, y = antenna_xy
+    with rasterio.open(dem_path) as src:
+        transform = src.transform
+        cell = abs(transform.a)
+        radius_cells = int(np.ceil(radius_km * units_per_km / cell))
+        # North-up grid: row and column straight from the transform
+        antenna_row = int(np.floor((y - transform.f) / transform.e))
+        antenna_col = int(np.floor((x - transform.c) / transform.a))
+        if not (0 <= antenna_row < src.height and 0 <= antenna_col < src.width):
+            raise ValueError("The antenna is outside the DEM")
+        row_off = max(antenna_row - radius_cells, 0)
+        col_off = max(antenna_col - radius_cells, 0)
+        rows = min(antenna_row + radius_cells + 1, src.height) - row_off
+        cols = min(antenna_col + radius_cells + 1, src.width) - col_off
+        window = Window(col_off, row_off, cols, rows)
+        dem = src.read(1, window=window, masked=True)
+        profile = src.profile.copy()
+        window_transform = type(transform)(transform.a, transform.b, transform.c + transform.a * col_off,
+                                           transform.d, transform.e, transform.f + transform.e * row_off)
+
+    valid = ~np.ma.getmaskarray(dem)
+    dem = dem.filled(np.nan).astype(np.float64)
+    loss, visible = terrain_loss(dem, antenna_row - row_off, antenna_col - col_off,
+                                 cell * 1000.0 / units_per_km, frequency, ht, hr,
+                                 radius_cells, workers, earth_curvature=earth_curvature)
+    if environment is not None:
+        a, b = hata_coefficients(frequency, ht, hr, environment)
+        distance = cell_distances(transform, row_off, col_off, rows, cols, x, y)
+        loss = loss + path_loss(distance / units_per_km, a, b)
+    valid &= np.isfinite(loss)
+
+    profile.update(driver='GTiff', width=cols, height=rows, transform=window_transform, count=1,
+                   dtype='float32', nodata=NODATA, tiled=True, blockxsize=256, blockysize=256,
+                   compress='deflate', BIGTIFF='IF_SAFER')
+    with rasterio.open(out_path, 'w', **profile) as dst:
+        dst.write(np.where(valid, loss, NODATA).astype(np.float32), 1)
+    if los_path:
+        with rasterio.open(los_path, 'w', **dict(profile, dtype='uint8', nodata=255)) as dst:
+            dst.write(np.where(valid, visible, 255).astype(np.uint8), 1)
+    return out_path
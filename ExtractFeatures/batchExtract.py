@@ -0,0 +1,132 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import extractFS
+import runMetrics
+from httpEngine import FetchEngine, current_flow
+
+# Example manifest:
+# {
+#     "staging": "batch_staging",
+#     "report": "batch_report.csv",
+#     "max_layers": 6,
+#     "max_concurrency": 32,
+#     "host_limits": {"gis.example.com": 8},
+#     "layers": [
+#         {"name": "parcels", "url": "https://gis.example.com/arcgis/rest/services/Parcels/FeatureServer/0",
+#          "output": "C:/data/nightly.gdb/parcels"}
+#     ]
+# }
+
+
+def load_manifest(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as manifest:
+        js = json.load(manifest)
+    for i, layer in enumerate(js["layers"]):
+        layer.setdefault("name", f"layer_{i}")
+    return js
+
+
+async def get_layer_size(engine: FetchEngine, layer: Dict) -> int:
+    try:
+        return await extractFS.get_record_count(engine, layer["url"])
+    except Exception as e:
+        logging.warning(f"Could not size {layer['name']}: {e}")
+        return 0
+
+
+async def run_layer(engine: FetchEngine, layer: Dict, staging_root: str,
+                    slots: asyncio.Semaphore, write_lock: threading.Lock) -> Dict:
+    result = {"layer": layer["name"], "url": layer["url"], "host": urlparse(layer["url"]).netloc,
+              "size": layer.get("size", 0), "features": 0, "bytes": 0, "pages": 0,
+              "seconds": 0.0, "status": "ok", "error": ""}
+    async with slots:
+        # Everything this task fetches is queued under the layer's own flow
+        current_flow.set(layer["name"])
+        logging.info(f"Starting {layer['name']} (~{result['size']} features)")
+        start = time.perf_counter()
+        try:
+            stats = await extractFS.extract(engine, layer["url"], layer["output"],
+                                            os.path.join(staging_root, layer["name"]),
+                                            write_lock=write_lock)
+            result.update(stats)
+        except Exception as e:
+            # A fatal service error only fails this layer
+            logging.error(f"{layer['name']} failed: {e}")
+            result["status"] = "failed"
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+async def run_batch(manifest: Dict) -> List[Dict]:
+    engine = FetchEngine(pool_size=manifest.get("max_concurrency", 32),
+                         max_concurrency=manifest.get("max_concurrency", 32),
+                         host_limits=manifest.get("host_limits"),
+                         target_latency=manifest.get("target_latency", 2.0))
+    try:
+        layers = manifest["layers"]
+        sizes = await asyncio.gather(*(get_layer_size(engine, layer) for layer in layers))
+        for layer, size in zip(layers, sizes):
+            layer["size"] = size
+        # Largest first: the long layers start early and small ones fill the gaps
+        layers = sorted(layers, key=lambda layer: layer["size"], reverse=True)
+
+        slots = asyncio.Semaphore(manifest.get("max_layers", 4))
+        # Writer stages run alongside downloads but flush one batch at a time
+        write_lock = threading.Lock()
+        staging_root = manifest.get("staging", "batch_staging")
+        return await asyncio.gather(*(run_layer(engine, layer, staging_root, slots, write_lock)
+                                      for layer in layers))
+    finally:
+        engine.close()
+
+
+def write_report(results: List[Dict], path: str):
+    columns = ["layer", "url", "host", "status", "size", "features", "pages", "bytes",
+               "seconds", "features_per_sec", "mb_per_sec", "error"]
+    with open(path, "w", newline="", encoding="utf-8") as report:
+        writer = csv.DictWriter(report, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            seconds = result["seconds"] or 1e-9
+            result["features_per_sec"] = round(result["features"] / seconds, 1)
+            result["mb_per_sec"] = round(result["bytes"] / seconds / 1e6, 3)
+            writer.writerow(result)
+
+    total_features = sum(r["features"] for r in results)
+    total_bytes = sum(r["bytes"] for r in results)
+    failed = [r["layer"] for r in results if r["status"] != "ok"]
+    logging.info(f"Batch finished: {len(results) - len(failed)}/{len(results)} layers, "
+                 f"{total_features} features, {total_bytes / 1e6:.1f} MB")
+    if failed:
+        logging.warning(f"Failed layers: {', '.join(failed)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract many feature layers through one shared worker pool.")
+    parser.add_argument("manifest", help="JSON manifest listing the layers to extract")
+    runMetrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    runMetrics.start(args.metrics_file, args.prometheus_port)
+    start = time.perf_counter()
+    try:
+        results = asyncio.run(run_batch(manifest))
+    finally:
+        runMetrics.finish(args.profile)
+    write_report(results, manifest.get("report", "batch_report.csv"))
+    logging.info(f"Total time: {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
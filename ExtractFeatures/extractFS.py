@@ -1,11 +1,27 @@
 import arcpy
 import requests
+import os
 import json
 import time
+import bisect
+import shutil
+import sqlite3
+import asyncio
+import contextlib
 import logging
-from typing import List, Tuple, Dict
-from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import urlencode
+import argparse
+import functools
+import threading
+from typing import List, Optional, Set, Tuple, Dict
+import pbfDecoder
+from pbfDecoder import FeaturePage
+from featureWriter import BatchedWriter, OrderedPageWriter, open_writer, split_geopackage
+from httpEngine import FetchEngine
+import runMetrics
+from runMetrics import metrics
+from pageStore import PageStore, range_key, parse_key
+from rangePlanner import RangePlanner, offset_pages
+from syncState import SyncState
 
 # Setup logging
 logging.basicConfig(filename='feature_extraction.log', level=logging.INFO,
@@ -15,29 +31,51 @@ logging.basicConfig(filename='feature_extraction.log', level=logging.INFO,
 arcpy.env.overwriteOutput = True
 baseURL = "Rest End Point"  # Replace with your actual URL
 fields = "*"  # Fields to retrieve
-outdata = "output location"  # Replace with your desired output location
+outdata = "output location"  # Feature class path, or "path.gpkg/table" for a GeoPackage
+staging = "extract_staging"  # Pages and checkpoint manifest; reuse it to resume a run
+max_concurrency = 16  # Upper bound; the engine adapts below this per host
+target_latency = 2.0  # Seconds to first byte before a response counts as slow (body download excluded)
+out_format = "auto"  # "auto" uses f=pbf when the service advertises it, else JSON
+return_geometry = True
+max_allowable_offset = None  # Server-side generalization in map units, e.g. 1.0
+quantization_tolerance = None  # Snap coordinates to this grid (map units) to shrink payloads
 
+sync_mode = False  # Only fetch and upsert features changed since the last run
+sync_state = "extract_state.sqlite"  # Per-layer edit dates and OBJECTID sets for sync mode
 
-def get_max_record_count(base_url: str) -> int:
-    urlstring = f"{base_url}?f=json"
+write_batch_rows = 5000  # Rows buffered per insert batch
+write_batch_bytes = 64 * 2 ** 20  # Or this many bytes of decoded pages, whichever comes first
+plan_mode = "auto"  # "ranges" (OBJECTID statistics), "offset" (resultOffset paging) or "ids" (full ID list)
+
+metrics_file = None  # JSON-lines file for per-request/per-stage metrics, e.g. "extract_metrics.jsonl"
+prometheus_port = None  # Serve Prometheus text metrics on this port during the run
+profile = False  # Print a per-stage time breakdown at the end of the run
+
+SOURCE_OID_FIELD = "SOURCE_OID"
+_service_info: Dict[str, Dict] = {}
+
+
+async def get_service_info(engine: FetchEngine, base_url: str) -> Dict:
+    if base_url not in _service_info:
+        _service_info[base_url] = await engine.get_json(base_url, {"f": "json"})
+    return _service_info[base_url]
+
+
+async def get_max_record_count(engine: FetchEngine, base_url: str) -> int:
     try:
-        response = requests.get(urlstring)
-        response.raise_for_status()
-        js = response.json()
+        js = await get_service_info(engine, base_url)
         max_record_count = int(js["maxRecordCount"])
         logging.info(f"Record extract limit: {max_record_count}")
         return max_record_count
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching max record count: {e}")
-        exit()
+        raise
 
 
-def get_object_ids(base_url: str) -> Tuple[str, List[int]]:
-    urlstring = f"{base_url}/query?where=1=1&returnIdsOnly=true&f=json"
+async def get_object_ids(engine: FetchEngine, base_url: str) -> Tuple[str, List[int]]:
+    params = {"where": "1=1", "returnIdsOnly": "true", "f": "json"}
     try:
-        response = requests.get(urlstring)
-        response.raise_for_status()
-        js = response.json()
+        js = await engine.get_json(f"{base_url}/query", params)
         id_field = js["objectIdFieldName"]
         id_list = js["objectIds"]
         id_list.sort()
@@ -45,23 +83,74 @@ def get_object_ids(base_url: str) -> Tuple[str, List[int]]:
         return id_field, id_list
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching object IDs: {e}")
-        exit()
+        raise
+
+
+def negotiate_format(service_info: Dict) -> str:
+    if out_format != "auto":
+        return out_format
+    supported = [f.strip().lower() for f in service_info.get("supportedQueryFormats", "").split(",")]
+    return "pbf" if "pbf" in supported else "json"
+
 
+def build_query_params(where: str, service_info: Dict, fmt: str) -> Dict:
+    params = {
+        "where": where,
+        "returnGeometry": "true" if return_geometry else "false",
+        "outFields": fields,
+        "f": fmt
+    }
+    if max_allowable_offset is not None:
+        params["maxAllowableOffset"] = max_allowable_offset
+    if quantization_tolerance is not None:
+        quantization = {"mode": "view", "originPosition": "upperLeft",
+                        "tolerance": quantization_tolerance}
+        if "extent" in service_info:
+            quantization["extent"] = service_info["extent"]
+        params["quantizationParameters"] = json.dumps(quantization)
+    return params
 
-def fetch_features(url: str) -> Dict:
+
+def _count_features(payload: bytes, fmt: str, decode: bool = False) -> Tuple[int, bool, Optional[FeaturePage]]:
+    """
+    Feature count and transfer-limit flag of a page.
+
+    PBF pages are only scanned. JSON has to be parsed to be counted, so with
+    ``decode`` the parsed page is also returned as a ``FeaturePage`` for an
+    in-process writer to use instead of parsing the staged file again.
+    """
+    with metrics.timer("parse", format=fmt, bytes=len(payload)):
+        if fmt == "pbf":
+            return (*pbfDecoder.scan(payload), None)
+        js = json.loads(payload)
+        if "error" in js:
+            raise ValueError(f"Server error: {js['error']}")
+        page = FeaturePage.from_esri_json(js) if decode else None
+    return len(js.get("features", [])), bool(js.get("exceededTransferLimit")), page
+
+
+def stage_page(store: PageStore, key: str, payload: bytes, count: int, fmt: str) -> str:
+    with metrics.timer("stage", key=key, count=count):
+        path = store.write(key, payload, count, fmt)
+    metrics.incr("features", count)
+    metrics.incr("pages")
+    return path
+
+
+async def fetch_features(engine: FetchEngine, url: str, params: Dict,
+                         decode: bool = False) -> Tuple[bytes, int, bool, Optional[FeaturePage]]:
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching features from {url}: {e}")
-        return {}
+        payload = await engine.get(url, params)
+        count, exceeded, page = await asyncio.to_thread(_count_features, payload, params["f"], decode)
+        return payload, count, exceeded, page
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Error fetching features for {params.get('objectIds') or params['where']}: {e}")
+        return b"", 0, False, None
 
 
-def gather_features(base_url: str, id_field: str, id_list: List[int], max_rc: int) -> List[arcpy.FeatureSet]:
+def build_ranges(id_field: str, id_list: List[int], max_rc: int) -> List[Tuple[str, str]]:
     num_rec = len(id_list)
-    feature_sets = {}
-    urls = []
+    ranges = []
 
     for i in range(0, num_rec, max_rc):
         to_rec = i + (max_rc - 1)
@@ -70,44 +159,407 @@ def gather_features(base_url: str, id_field: str, id_list: List[int], max_rc: in
         from_id = id_list[i]
         to_id = id_list[to_rec]
         where = f"{id_field} >= {from_id} and {id_field} <= {to_id}"
-        params = {
-            "where": where,
-            "returnGeometry": "true",
-            "outFields": fields,
-            "f": "json"
-        }
-        query_string = urlencode(params)
-        urlstring = f"{base_url}/query?{query_string}"
-        urls.append(urlstring)
-
-    # Fetch data in parallel
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        results = list(executor.map(fetch_features, urls))
-
-    # Load features into FeatureSets
-    for i, result in enumerate(results):
-        if result:
-            feature_set = arcpy.FeatureSet()
-            feature_set.load(result)
-            feature_sets[i] = feature_set
-
-    return list(feature_sets.values())
-
-
-def save_features(feature_sets: List[arcpy.FeatureSet], output_location: str):
+        ranges.append((range_key("oid", from_id, to_id), where))
+
+    return ranges
+
+
+async def fetch_pages(engine: FetchEngine, base_url: str, pages: List[Tuple[str, Dict]],
+                      store: PageStore, fmt: str, stage: Optional[OrderedPageWriter] = None) -> int:
+    # A fixed set of workers pulls pages off a shared iterator; the engine's
+    # adaptive limiter decides how many of them are actually on the wire.
+    # Every page goes to disk as it lands so memory stays flat.
+    pending = iter(pages)
+    outstanding = sorted(parse_key(key)[1] for key, _ in pages)
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        for key, params in pending:
+            payload, count, _, page = await fetch_features(engine, f"{base_url}/query", params, decode=bool(stage))
+            if payload:
+                path = await asyncio.to_thread(stage_page, store, key, payload, count, fmt)
+                # Failed pages stay outstanding so the writer never skips past them
+                outstanding.pop(bisect.bisect_left(outstanding, parse_key(key)[1]))
+                if stage:
+                    stage.offer(key, path, page)
+                    stage.release(outstanding[0] if outstanding else float("inf"))
+            else:
+                failed += 1
+
+    await asyncio.gather(*(worker() for _ in range(engine.max_concurrency)))
+    return failed
+
+
+async def gather_features(engine: FetchEngine, base_url: str, id_field: str, id_list: List[int],
+                          max_rc: int, store: PageStore, stage: Optional[OrderedPageWriter] = None) -> int:
+    service_info = await get_service_info(engine, base_url)
+    fmt = negotiate_format(service_info)
+    pages = [(key, build_query_params(where, service_info, fmt))
+             for key, where in build_ranges(id_field, id_list, max_rc)
+             if not store.is_done(key)]
+    logging.info(f"{len(pages)} pages to fetch as f={fmt}")
+
+    failed = await fetch_pages(engine, base_url, pages, store, fmt, stage)
+    if failed:
+        logging.warning(f"{failed} pages failed; rerun to fetch only the missing ranges")
+    return failed
+
+
+def get_plan_mode(service_info: Dict) -> str:
+    if plan_mode != "auto":
+        return plan_mode
+    capabilities = service_info.get("advancedQueryCapabilities", {})
+    if capabilities.get("supportsStatistics", service_info.get("supportsStatistics")):
+        return "ranges"
+    if capabilities.get("supportsPagination"):
+        return "offset"
+    return "ids"
+
+
+def get_id_field(service_info: Dict) -> str:
+    if service_info.get("objectIdField"):
+        return service_info["objectIdField"]
+    return next(f["name"] for f in service_info.get("fields", []) if f["type"] == "esriFieldTypeOID")
+
+
+async def get_id_statistics(engine: FetchEngine, base_url: str, id_field: str) -> Tuple[int, int, int]:
+    stats = [{"statisticType": stat, "onStatisticField": id_field, "outStatisticFieldName": f"{stat}_oid"}
+             for stat in ("min", "max", "count")]
+    params = {"where": "1=1", "outStatistics": json.dumps(stats), "f": "json"}
+    js = await engine.get_json(f"{base_url}/query", params)
+    if "error" in js:
+        raise ValueError(f"Statistics query failed: {js['error']}")
+    # Some servers change the case of output statistic names
+    attributes = {k.lower(): v for k, v in js["features"][0]["attributes"].items()}
+    return attributes["min_oid"], attributes["max_oid"], attributes["count_oid"]
+
+
+async def get_record_count(engine: FetchEngine, base_url: str) -> int:
+    js = await engine.get_json(f"{base_url}/query", {"where": "1=1", "returnCountOnly": "true", "f": "json"})
+    return int(js["count"])
+
+
+async def gather_ranges(engine: FetchEngine, base_url: str, id_field: str, max_rc: int,
+                        store: PageStore, stage: Optional[OrderedPageWriter] = None) -> int:
+    min_id, max_id, count = await get_id_statistics(engine, base_url, id_field)
+    logging.info(f"Number of target records: {count} (OBJECTID {min_id}-{max_id})")
+    if not count:
+        return 0
+    service_info = await get_service_info(engine, base_url)
+    fmt = negotiate_format(service_info)
+    done = [parse_key(key)[1:] for key in store.done_keys() if key.startswith("oid:")]
+    planner = RangePlanner(min_id, max_id, count, max_rc, done)
+    changed = asyncio.Condition()
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        while True:
+            async with changed:
+                # Wait while other workers may still split ranges back into the queue
+                while (rng := planner.next_range()) is None and not planner.finished():
+                    await changed.wait()
+            if rng is None:
+                return
+            lo, hi = rng
+            params = build_query_params(f"{id_field} >= {lo} and {id_field} <= {hi}", service_info, fmt)
+            payload, count, exceeded, page = await fetch_features(engine, f"{base_url}/query", params,
+                                                                  decode=bool(stage))
+            # Stage the page before reporting it so the writer's watermark
+            # never moves past a page that is not on disk yet
+            if payload and count and not (exceeded and hi > lo):
+                key = range_key("oid", lo, hi)
+                path = await asyncio.to_thread(stage_page, store, key, payload, count, fmt)
+                if stage:
+                    stage.offer(key, path, page)
+            async with changed:
+                if payload:
+                    planner.report(lo, hi, count, exceeded)
+                else:
+                    planner.failed(lo, hi)
+                    failed += 1
+                changed.notify_all()
+                if stage and not failed:
+                    stage.release(planner.low_watermark())
+
+    await asyncio.gather(*(worker() for _ in range(engine.max_concurrency)))
+    if failed:
+        logging.warning(f"{failed} ranges failed; rerun to fetch only the missing ranges")
+    return failed
+
+
+async def gather_offsets(engine: FetchEngine, base_url: str, id_field: str, max_rc: int,
+                         store: PageStore, stage: Optional[OrderedPageWriter] = None) -> int:
+    total = await get_record_count(engine, base_url)
+    logging.info(f"Number of target records: {total}")
+    service_info = await get_service_info(engine, base_url)
+    fmt = negotiate_format(service_info)
+    pages = []
+    for offset, size in offset_pages(total, max_rc):
+        key = range_key("offset", offset, offset + size - 1)
+        if store.is_done(key):
+            continue
+        params = build_query_params("1=1", service_info, fmt)
+        params.update({"resultOffset": offset, "resultRecordCount": size, "orderByFields": id_field})
+        pages.append((key, params))
+    logging.info(f"{len(pages)} pages to fetch as f={fmt}")
+
+    failed = await fetch_pages(engine, base_url, pages, store, fmt, stage)
+    if failed:
+        logging.warning(f"{failed} pages failed; rerun to fetch only the missing pages")
+    return failed
+
+
+def load_page(path: str, tag_source_oid: bool = False, page: Optional[FeaturePage] = None) -> FeaturePage:
+    """Decode a staged page, unless the fetch side already handed over the decoded ``page``."""
+    if page is None:
+        with open(path, "rb") as page_file:
+            payload = page_file.read()
+        with metrics.timer("parse", page=os.path.basename(path)):
+            if path.endswith(".pbf"):
+                page = pbfDecoder.decode(payload)
+            else:
+                page = FeaturePage.from_esri_json(json.loads(payload))
+    if tag_source_oid:
+        # Copy the service OBJECTID into its own field; the output assigns
+        # new OBJECTIDs, so sync mode needs this to find rows to upsert
+        page.add_column(SOURCE_OID_FIELD, "esriFieldTypeInteger", list(page.attributes[page.object_id_field]))
+    return page
+
+
+def open_output(output_location: str, append: bool = False,
+                lock: Optional[threading.Lock] = None) -> BatchedWriter:
+    return open_writer(output_location, append=append, batch_rows=write_batch_rows,
+                       batch_bytes=write_batch_bytes, lock=lock)
+
+
+def save_features(store: PageStore, output_location: str, append: bool = False,
+                  tag_source_oid: bool = False):
+    # Pages are decoded one at a time and bulk-inserted in batches, so memory
+    # is bounded by the write budget rather than the layer size
     try:
-        arcpy.Merge_management(feature_sets, output_location)
-        logging.info("Features saved successfully.")
+        writer = open_output(output_location, append)
+        for key, path in store.pages():
+            writer.write_page(load_page(path, tag_source_oid))
+        writer.close()
+        logging.info(f"Features saved successfully ({writer.rows_written} features).")
     except arcpy.ExecuteError as e:
         logging.error(f"Error saving features: {e}")
-        exit()
+        raise
+
+
+class ExtractionError(Exception):
+    """Raised when some pages could not be fetched; the checkpoint is kept for a rerun."""
+
+
+async def extract(engine: FetchEngine, base_url: str, output_location: str, staging_dir: str,
+                  tag_source_oid: bool = False, write_lock: Optional[threading.Lock] = None) -> Dict:
+    max_record_count = await get_max_record_count(engine, base_url)
+    service_info = await get_service_info(engine, base_url)
+    mode = get_plan_mode(service_info)
+    logging.info(f"Planning pages for {base_url} by {mode}")
+    store = PageStore(staging_dir)
+
+    # The writer stage inserts pages, in order, while later pages download
+    stage = OrderedPageWriter(store, open_output(output_location, lock=write_lock),
+                              functools.partial(load_page, tag_source_oid=tag_source_oid),
+                              key_start=lambda key: parse_key(key)[1])
+    stage.start()
+    try:
+        if mode == "ranges":
+            failed = await gather_ranges(engine, base_url, get_id_field(service_info), max_record_count,
+                                         store, stage)
+        elif mode == "offset":
+            failed = await gather_offsets(engine, base_url, get_id_field(service_info), max_record_count,
+                                          store, stage)
+        else:
+            id_field, id_list = await get_object_ids(engine, base_url)
+            failed = await gather_features(engine, base_url, id_field, id_list, max_record_count,
+                                           store, stage)
+    except BaseException:
+        await asyncio.to_thread(stage.abort)
+        raise
+    if failed:
+        await asyncio.to_thread(stage.abort)
+        raise ExtractionError(f"{failed} pages failed for {base_url}; output is incomplete")
+    # Whatever the writer still has to do once the last page has landed
+    with metrics.timer("merge", url=base_url):
+        rows = await asyncio.to_thread(stage.finish)
+    logging.info(f"Features saved successfully ({rows} features).")
+    stats = {"features": store.feature_count(), "bytes": store.byte_count(), "pages": len(store.done_keys())}
+    # The checkpoint only exists to resume a crashed run; clear it so the
+    # next run does not reuse stale pages
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return stats
+
+
+def _split_url(base_url: str) -> Tuple[str, int]:
+    service_url, layer_id = base_url.rstrip("/").rsplit("/", 1)
+    return service_url, int(layer_id)
+
+
+async def get_changes_from_tracking(engine: FetchEngine, base_url: str,
+                                    server_gen: int) -> Tuple[List[int], List[int], List[int], int]:
+    service_url, layer_id = _split_url(base_url)
+    params = {
+        "layers": json.dumps([layer_id]),
+        "layerServerGens": json.dumps([{"id": layer_id, "serverGen": server_gen}]),
+        "returnInserts": "true",
+        "returnUpdates": "true",
+        "returnDeletes": "true",
+        "returnIdsOnly": "true",
+        "f": "json"
+    }
+    js = await engine.get_json(f"{service_url}/extractChanges", params)
+    if "error" in js:
+        raise ValueError(f"extractChanges failed: {js['error']}")
+    edits = next((e["objectIds"] for e in js.get("edits", []) if e["id"] == layer_id), {})
+    new_gen = next(g["serverGen"] for g in js["layerServerGens"] if g["id"] == layer_id)
+    return edits.get("adds", []), edits.get("updates", []), edits.get("deletes", []), new_gen
+
+
+async def get_changes_from_edit_date(engine: FetchEngine, base_url: str, edit_field: str,
+                                     since: int, known: Set[int]) -> Tuple[List[int], List[int], List[int]]:
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(since / 1000))
+    params = {"where": f"{edit_field} > timestamp '{stamp}'", "returnIdsOnly": "true", "f": "json"}
+    js = await engine.get_json(f"{base_url}/query", params)
+    changed = set(js.get("objectIds") or [])
+    # Deletes leave no edit date behind, so compare against the full ID set
+    _, current = await get_object_ids(engine, base_url)
+    current = set(current)
+    adds = sorted((current - known) | (changed - known))
+    updates = sorted(changed & known)
+    deletes = sorted(known - current)
+    return adds, updates, deletes
+
+
+def output_exists(output_location: str) -> bool:
+    geopackage = split_geopackage(output_location)
+    if geopackage:
+        return os.path.exists(geopackage[0])
+    return arcpy.Exists(output_location)
+
+
+def delete_source_oids(output_location: str, oids: List[int]):
+    geopackage = split_geopackage(output_location)
+    if geopackage:
+        # The connection's own context manager only commits; closing() releases the file
+        with contextlib.closing(sqlite3.connect(geopackage[0])) as conn, conn:
+            for i in range(0, len(oids), 1000):
+                chunk = ",".join(str(oid) for oid in oids[i:i + 1000])
+                conn.execute(f'DELETE FROM "{geopackage[1]}" WHERE {SOURCE_OID_FIELD} IN ({chunk})')
+        return
+    for i in range(0, len(oids), 1000):
+        chunk = ",".join(str(oid) for oid in oids[i:i + 1000])
+        with arcpy.da.UpdateCursor(output_location, [SOURCE_OID_FIELD],
+                                   f"{SOURCE_OID_FIELD} IN ({chunk})") as cursor:
+            for _ in cursor:
+                cursor.deleteRow()
+
+
+def output_source_oids(output_location: str) -> List[int]:
+    """Source OBJECTIDs of the features actually written to the output."""
+    geopackage = split_geopackage(output_location)
+    if geopackage:
+        with contextlib.closing(sqlite3.connect(geopackage[0])) as conn:
+            return [oid for (oid,) in conn.execute(f'SELECT {SOURCE_OID_FIELD} FROM "{geopackage[1]}"')]
+    with arcpy.da.SearchCursor(output_location, [SOURCE_OID_FIELD]) as cursor:
+        return [oid for (oid,) in cursor]
+
+
+async def extract_baseline(engine: FetchEngine, state: SyncState, last_edit: Optional[int], server_gen: Optional[int]):
+    await extract(engine, baseURL, outdata, staging, tag_source_oid=True)
+    # The known set is what the extract wrote, not an ID list fetched before
+    # it: features added while it ran were never written, so the next sync
+    # picks them up as adds instead of reporting them as deletes
+    state.replace_oids(baseURL, output_source_oids(outdata))
+    state.mark(baseURL, last_edit, server_gen)
+
+
+async def sync(engine: FetchEngine):
+    state = SyncState(sync_state)
+    try:
+        service_info = await get_service_info(engine, baseURL)
+        last_edit = service_info.get("editingInfo", {}).get("lastEditDate")
+        edit_field = (service_info.get("editFieldsInfo") or {}).get("editDateField")
+        service_url, _ = _split_url(baseURL)
+        root_info = await engine.get_json(service_url, {"f": "json"})
+        tracking = "ChangeTracking" in root_info.get("capabilities", "")
+        server_gen = None
+        if tracking:
+            gens = root_info.get("changeTrackingInfo", {}).get("layerServerGens", [])
+            _, layer_id = _split_url(baseURL)
+            server_gen = next((g["serverGen"] for g in gens if g["id"] == layer_id), None)
+
+        previous = state.get(baseURL)
+        if previous is None or not output_exists(outdata):
+            logging.info("No sync state for this layer; running a full baseline extract")
+            await extract_baseline(engine, state, last_edit, server_gen)
+            return
+
+        prev_edit, prev_gen = previous
+        if last_edit is not None and last_edit == prev_edit:
+            logging.info("Layer unchanged since last sync")
+            return
+
+        if tracking and prev_gen is not None:
+            adds, updates, deletes, server_gen = await get_changes_from_tracking(engine, baseURL, prev_gen)
+        elif edit_field and prev_edit is not None:
+            adds, updates, deletes = await get_changes_from_edit_date(
+                engine, baseURL, edit_field, prev_edit, state.known_oids(baseURL))
+        else:
+            logging.warning("Layer has no edit tracking; falling back to a full extract")
+            await extract_baseline(engine, state, last_edit, server_gen)
+            return
+        logging.info(f"Changes: {len(adds)} adds, {len(updates)} updates, {len(deletes)} deletes")
+
+        # Fetch only new and changed features, by explicit OBJECTID list
+        max_rc = await get_max_record_count(engine, baseURL)
+        fmt = negotiate_format(service_info)
+        changed = adds + updates
+        delta = PageStore(os.path.join(staging, f"delta_{int(time.time())}"))
+        pages = []
+        for i in range(0, len(changed), max_rc):
+            chunk = changed[i:i + max_rc]
+            params = build_query_params("1=1", service_info, fmt)
+            params["objectIds"] = ",".join(str(oid) for oid in chunk)
+            pages.append((range_key("ids", i, i + len(chunk) - 1), params))
+        failed = await fetch_pages(engine, baseURL, pages, delta, fmt)
+        if failed:
+            raise ExtractionError(f"{failed} delta pages failed; output and sync state left unchanged")
+
+        # Adds are deleted too so a feature captured by both the baseline and
+        # this delta is never duplicated
+        delete_source_oids(outdata, sorted(set(changed) | set(deletes)))
+        save_features(delta, outdata, append=True, tag_source_oid=True)
+        shutil.rmtree(delta.staging_dir, ignore_errors=True)
+
+        state.apply(baseURL, adds, deletes)
+        state.mark(baseURL, last_edit, server_gen)
+    finally:
+        state.close()
 
 
 def main():
-    max_record_count = get_max_record_count(baseURL)
-    id_field, id_list = get_object_ids(baseURL)
-    feature_sets = gather_features(baseURL, id_field, id_list, max_record_count)
-    save_features(feature_sets, outdata)
+    parser = argparse.ArgumentParser(description="Extract features from an ArcGIS REST endpoint.")
+    runMetrics.add_arguments(parser)
+    args = parser.parse_args()
+    runMetrics.start(args.metrics_file or metrics_file,
+                     args.prometheus_port if args.prometheus_port is not None else prometheus_port)
+
+    engine = FetchEngine(max_concurrency=max_concurrency, target_latency=target_latency)
+    try:
+        asyncio.run(sync(engine) if sync_mode else extract(engine, baseURL, outdata, staging))
+    except ExtractionError as e:
+        logging.error(f"Extraction incomplete: {e}. Rerun to fetch only the missing pages.")
+        exit()
+    except (requests.exceptions.RequestException, arcpy.ExecuteError):
+        # Already logged where it was raised
+        exit()
+    finally:
+        engine.close()
+        runMetrics.finish(args.profile or profile)
     logging.info("Done!")
 
 
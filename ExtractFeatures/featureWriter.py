@@ -0,0 +1,417 @@
+import os
+import json
+import struct
+import sqlite3
+import logging
+import heapq
+import datetime
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pbfDecoder import FeaturePage
+from runMetrics import metrics
+
+SKIP_FIELD_TYPES = {"esriFieldTypeOID", "esriFieldTypeGeometry"}
+
+ARCPY_FIELD_TYPES = {
+    "esriFieldTypeSmallInteger": "SHORT",
+    "esriFieldTypeInteger": "LONG",
+    "esriFieldTypeSingle": "FLOAT",
+    "esriFieldTypeDouble": "DOUBLE",
+    "esriFieldTypeString": "TEXT",
+    "esriFieldTypeDate": "DATE",
+    "esriFieldTypeGUID": "GUID",
+    "esriFieldTypeGlobalID": "GUID",
+    "esriFieldTypeBlob": "BLOB",
+    "esriFieldTypeXML": "TEXT",
+}
+
+ARCPY_GEOMETRY_TYPES = {
+    "esriGeometryPoint": "POINT",
+    "esriGeometryMultipoint": "MULTIPOINT",
+    "esriGeometryPolyline": "POLYLINE",
+    "esriGeometryPolygon": "POLYGON",
+}
+
+SQLITE_FIELD_TYPES = {
+    "esriFieldTypeSmallInteger": "SMALLINT",
+    "esriFieldTypeInteger": "INTEGER",
+    "esriFieldTypeSingle": "FLOAT",
+    "esriFieldTypeDouble": "DOUBLE",
+    "esriFieldTypeDate": "DATETIME",
+    "esriFieldTypeBlob": "BLOB",
+}
+
+GPKG_GEOMETRY_TYPES = {
+    "esriGeometryPoint": ("POINT", 1),
+    "esriGeometryMultipoint": ("MULTIPOINT", 4),
+    "esriGeometryPolyline": ("MULTILINESTRING", 5),
+    "esriGeometryPolygon": ("MULTIPOLYGON", 6),
+}
+
+DEFAULT_TEXT_LENGTH = 2048
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_datetime(value):
+    if value is None:
+        return None
+    return EPOCH + datetime.timedelta(milliseconds=value)
+
+
+class BatchedWriter:
+    """
+    Buffers decoded pages and writes them in batches.
+
+    A batch is flushed once it holds ``batch_rows`` features or roughly
+    ``batch_bytes`` of decoded data, whichever comes first. Pages are written
+    in the order they are handed in, so output row order follows page order.
+    Subclasses create the output from the first page's schema and insert rows.
+    """
+
+    def __init__(self, batch_rows: int = 5000, batch_bytes: int = 64 * 2 ** 20,
+                 lock: Optional[threading.Lock] = None):
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        # Shared by writers that must not touch the same workspace at once
+        self.lock = lock or threading.Lock()
+        self.rows_written = 0
+        self._pending: List[FeaturePage] = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._created = False
+
+    def write_page(self, page: FeaturePage):
+        if not self._created:
+            with self.lock:
+                self._create(page)
+            self._created = True
+        self._pending.append(page)
+        self._pending_rows += len(page)
+        self._pending_bytes += page.nbytes
+        if self._pending_rows >= self.batch_rows or self._pending_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self.lock, metrics.timer("load", rows=self._pending_rows):
+                self._insert(self._pending)
+            self.rows_written += self._pending_rows
+            metrics.incr("rows_written", self._pending_rows)
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self._close()
+
+    def _create(self, page: FeaturePage):
+        raise NotImplementedError
+
+    def _insert(self, pages: List[FeaturePage]):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class ArcpyWriter(BatchedWriter):
+    """Writes to a geodatabase feature class through one long-lived InsertCursor."""
+
+    def __init__(self, output_location: str, append: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        import arcpy
+        self.arcpy = arcpy
+        self.output_location = output_location
+        self.append = append
+        self._cursor = None
+        self._names: List[str] = []
+        self._dates: List[int] = []
+
+    def _create(self, page: FeaturePage):
+        arcpy = self.arcpy
+        fields = [(name, ftype) for name, ftype in page.fields if ftype not in SKIP_FIELD_TYPES]
+        if not self.append:
+            out_path, out_name = os.path.split(self.output_location)
+            spatial_reference = arcpy.SpatialReference(
+                page.spatial_reference.get("latestWkid") or page.spatial_reference.get("wkid"))
+            arcpy.management.CreateFeatureclass(
+                out_path, out_name, ARCPY_GEOMETRY_TYPES[page.geometry_type],
+                has_m="ENABLED" if page.has_m else "DISABLED",
+                has_z="ENABLED" if page.has_z else "DISABLED",
+                spatial_reference=spatial_reference)
+            for name, ftype in fields:
+                arcpy.management.AddField(self.output_location, name, ARCPY_FIELD_TYPES.get(ftype, "TEXT"),
+                                          field_length=page.field_lengths.get(name, DEFAULT_TEXT_LENGTH))
+        else:
+            existing = {f.name.lower() for f in arcpy.ListFields(self.output_location)}
+            fields = [(name, ftype) for name, ftype in fields if name.lower() in existing]
+        self._names = [name for name, _ in fields]
+        self._dates = [i for i, (_, ftype) in enumerate(fields) if ftype == "esriFieldTypeDate"]
+        self._cursor = arcpy.da.InsertCursor(self.output_location, ["SHAPE@JSON"] + self._names)
+
+    def _insert(self, pages: List[FeaturePage]):
+        for page in pages:
+            columns = [page.attributes[name] for name in self._names]
+            for i in self._dates:
+                columns[i] = [_to_datetime(value) for value in columns[i]]
+            for geometry, *values in zip(page.geometries(), *columns):
+                shape = json.dumps(geometry) if geometry is not None else None
+                self._cursor.insertRow([shape] + values)
+
+    def _close(self):
+        if self._cursor is not None:
+            del self._cursor
+            self._cursor = None
+
+
+def _signed_area(ring: np.ndarray) -> float:
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+class GeoPackageWriter(BatchedWriter):
+    """
+    Writes a GeoPackage feature table with only the standard library and NumPy.
+
+    Each batch is inserted with ``executemany`` inside a single transaction.
+    """
+
+    def __init__(self, path: str, table: str, append: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.table = table
+        self.append = append
+        # The writer stage runs on its own thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._names: List[str] = []
+        self._dims = 2
+        self._wkb_type = 0
+        self._srs_id = 0
+
+    def _create(self, page: FeaturePage):
+        conn = self.conn
+        geometry_name, base_type = GPKG_GEOMETRY_TYPES[page.geometry_type]
+        self._dims = 2 + page.has_z + page.has_m
+        self._wkb_type = base_type + (1000 if page.has_z else 0) + (2000 if page.has_m else 0)
+        self._srs_id = page.spatial_reference.get("latestWkid") or page.spatial_reference.get("wkid") or 0
+        fields = [(name, ftype) for name, ftype in page.fields if ftype not in SKIP_FIELD_TYPES]
+        self._names = [name for name, _ in fields]
+        self._dates = {name for name, ftype in fields if ftype == "esriFieldTypeDate"}
+        self._geometry_type = page.geometry_type
+
+        conn.execute("PRAGMA application_id = 1196444487")  # 'GPKG'
+        conn.execute("PRAGMA user_version = 10300")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            CREATE TABLE IF NOT EXISTS gpkg_contents (
+                table_name TEXT PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+            CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+        """)
+        conn.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+        ])
+        if self._srs_id > 0:
+            conn.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+                         (f"EPSG:{self._srs_id}", self._srs_id, "EPSG", self._srs_id,
+                          page.spatial_reference.get("wkt", "undefined"), None))
+        if self.append:
+            return
+
+        columns = ", ".join(f'"{name}" {SQLITE_FIELD_TYPES.get(ftype, "TEXT")}' for name, ftype in fields)
+        conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        conn.execute(f'CREATE TABLE "{self.table}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     f'geom {geometry_name}{", " + columns if columns else ""})')
+        conn.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (self.table,))
+        conn.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (self.table,))
+        conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, ?)",
+                     (self.table, self.table, self._srs_id))
+        conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, ?, ?)",
+                     (self.table, geometry_name, self._srs_id, int(page.has_z), int(page.has_m)))
+        conn.commit()
+
+    def _wkb(self, coords: np.ndarray, lengths: np.ndarray) -> Optional[bytes]:
+        if len(coords) == 0:
+            return None
+        coords = np.ascontiguousarray(coords, dtype="<f8")
+        # Standard GeoPackage header: magic, version 0, little endian, XY envelope
+        minx, miny = coords[:, 0].min(), coords[:, 1].min()
+        maxx, maxy = coords[:, 0].max(), coords[:, 1].max()
+        header = b"GP" + struct.pack("<BBi4d", 0, 0b011, self._srs_id, minx, maxx, miny, maxy)
+
+        # Multi types are 3 above their part types (MultiPolygon 6 -> Polygon 3)
+        part_type = self._wkb_type - {1: 0, 4: 3, 5: 3, 6: 3}[self._wkb_type % 1000]
+        if self._geometry_type == "esriGeometryPoint":
+            return header + struct.pack("<BI", 1, self._wkb_type) + coords[0].tobytes()
+        if self._geometry_type == "esriGeometryMultipoint":
+            body = b"".join(struct.pack("<BI", 1, part_type) + row.tobytes() for row in coords)
+            return header + struct.pack("<BII", 1, self._wkb_type, len(coords)) + body
+
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        parts = [coords[offsets[i]:offsets[i + 1]] for i in range(len(lengths))]
+        if self._geometry_type == "esriGeometryPolyline":
+            body = b"".join(struct.pack("<BII", 1, part_type, len(part)) + part.tobytes() for part in parts)
+            return header + struct.pack("<BII", 1, self._wkb_type, len(parts)) + body
+
+        # Esri rings: clockwise outer rings, each followed by its counter-clockwise holes
+        polygons: List[List[np.ndarray]] = []
+        for ring in parts:
+            if _signed_area(ring) <= 0 or not polygons:
+                polygons.append([ring])
+            else:
+                polygons[-1].append(ring)
+        body = b"".join(
+            struct.pack("<BII", 1, part_type, len(rings))
+            + b"".join(struct.pack("<I", len(ring)) + ring.tobytes() for ring in rings)
+            for rings in polygons)
+        return header + struct.pack("<BII", 1, self._wkb_type, len(polygons)) + body
+
+    def _insert(self, pages: List[FeaturePage]):
+        placeholders = ", ".join("?" for _ in range(len(self._names) + 1))
+        columns = ", ".join(["geom"] + [f'"{name}"' for name in self._names])
+        sql = f'INSERT INTO "{self.table}" ({columns}) VALUES ({placeholders})'
+        with self.conn:
+            for page in pages:
+                values = [page.attributes.get(name, [None] * len(page)) for name in self._names]
+                for i, name in enumerate(self._names):
+                    if name in self._dates:
+                        values[i] = [None if v is None else _to_datetime(v).isoformat(timespec="milliseconds") + "Z"
+                                     for v in values[i]]
+                geometries = (self._wkb(coords, lengths) for coords, lengths in page.geometry_slices())
+                self.conn.executemany(sql, zip(geometries, *values))
+
+    def _close(self):
+        self.conn.close()
+
+
+def split_geopackage(output_location: str) -> Optional[Tuple[str, str]]:
+    """Return (path, table) for ``path.gpkg`` or ``path.gpkg/table`` outputs, else None."""
+    lowered = output_location.lower()
+    if ".gpkg" not in lowered:
+        return None
+    index = lowered.index(".gpkg") + len(".gpkg")
+    path, table = output_location[:index], output_location[index:].strip("/\\")
+    return path, table or os.path.splitext(os.path.basename(path))[0]
+
+
+def open_writer(output_location: str, append: bool = False, **kwargs) -> BatchedWriter:
+    """GeoPackage for ``.gpkg`` outputs; a geodatabase feature class otherwise."""
+    geopackage = split_geopackage(output_location)
+    if geopackage:
+        return GeoPackageWriter(*geopackage, append=append, **kwargs)
+    return ArcpyWriter(output_location, append=append, **kwargs)
+
+
+class OrderedPageWriter(threading.Thread):
+    """
+    Background stage that writes staged pages while downloads continue.
+
+    The fetch side calls ``offer(key, path)`` for each page it stages and
+    ``release(watermark)`` whenever every page starting below ``watermark``
+    has been settled; the thread then writes the queued pages below it in
+    key order. Because pages are only written once all earlier ranges are
+    done, the output has the same row order as a merge of every page at the
+    end. Pages already in ``store`` (a resumed checkpoint) are queued at start.
+
+    A page the fetch side already decoded can be passed to ``offer`` so it
+    is not parsed again from disk; ``load_page(path, page=...)`` receives it.
+    At most ``max_decoded`` are held; beyond that a page is read back from
+    its staged file when its turn comes.
+    """
+
+    def __init__(self, store, writer: BatchedWriter, load_page: Callable[..., FeaturePage],
+                 key_start: Callable[[str], int], max_decoded: int = 64):
+        super().__init__(name="page-writer", daemon=True)
+        self.store = store
+        self.writer = writer
+        self.load_page = load_page
+        self.key_start = key_start
+        self.error: Optional[BaseException] = None
+        self._watermark = float("-inf")
+        self._closing = False
+        self._aborted = False
+        # (start, key, path) of every queued page not yet written, and every key ever queued
+        self._queue: List[Tuple[int, str, str]] = []
+        self._queued = set()
+        self._decoded: Dict[str, FeaturePage] = {}
+        self.max_decoded = max_decoded
+        self._cond = threading.Condition()
+        for key, path in store.pages():
+            self._push(key, path)
+
+    def _push(self, key: str, path: str) -> bool:
+        if key in self._queued:
+            return False
+        self._queued.add(key)
+        heapq.heappush(self._queue, (self.key_start(key), key, path))
+        return True
+
+    def offer(self, key: str, path: str, page: Optional[FeaturePage] = None):
+        """Queue a staged page, with its decoded page if there is room for it."""
+        with self._cond:
+            if not self._push(key, path):
+                return
+            if page is not None and len(self._decoded) < self.max_decoded:
+                self._decoded[key] = page
+            if self.key_start(key) < self._watermark:
+                self._cond.notify()
+
+    def release(self, watermark: float):
+        with self._cond:
+            if watermark > self._watermark:
+                self._watermark = watermark
+                self._cond.notify()
+
+    def _take_ready(self) -> List[Tuple[str, Optional[FeaturePage]]]:
+        """Pop the queued pages below the watermark, in key order."""
+        ready = []
+        while self._queue and self._queue[0][0] < self._watermark:
+            _, key, path = heapq.heappop(self._queue)
+            ready.append((path, self._decoded.pop(key, None)))
+        return ready
+
+    def run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not (ready := self._take_ready()) and not self._closing and not self._aborted:
+                        self._cond.wait()
+                    if self._aborted:
+                        return
+                    if not ready:
+                        break
+                for path, page in ready:
+                    self.writer.write_page(self.load_page(path, page=page))
+            self.writer.close()
+        except BaseException as e:
+            self.error = e
+            logging.error(f"Writer stage failed: {e}")
+
+    def finish(self) -> int:
+        """Write everything that is left, close the output and return the row count."""
+        with self._cond:
+            self._watermark = float("inf")
+            self._closing = True
+            self._cond.notify()
+        self.join()
+        if self.error:
+            raise self.error
+        return self.writer.rows_written
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify()
+        self.join()
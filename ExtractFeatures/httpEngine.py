@@ -0,0 +1,305 @@
+import time
+import json
+import random
+import socket
+import threading
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from runMetrics import metrics
+
+# Layer (or other unit of work) the running task is fetching for; set it at
+# the top of a task and every request made under it is queued fairly
+current_flow: ContextVar = ContextVar("current_flow", default=None)
+
+# Status codes that mean "slow down" rather than "this request is broken"
+THROTTLE_STATUS = {429, 503}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class FetchError(requests.exceptions.RequestException):
+    """Raised when a request still fails after every retry."""
+
+
+# Connect time spent by the current worker thread during its current request,
+# so it can be taken out of the time to first byte
+_connect_time = threading.local()
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        seconds = time.perf_counter() - start
+        _connect_time.seconds = getattr(_connect_time, "seconds", 0.0) + seconds
+        metrics.add_time("connect", seconds)
+        metrics.incr("connections", host=self.host)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """``HTTPAdapter`` whose pooled connections report TCP/TLS connect time."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool,
+                                                   "https": _TimedHTTPSConnectionPool}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for a single host.
+
+    The limit grows by one after a run of fast responses and is halved on
+    HTTP 429/503 or when the server's time to first byte climbs past the
+    target, so the engine backs off as soon as a server shows signs of
+    strain. Body download time is left out, so large pages on slow links do
+    not read as a busy server. A response is slow only when it is over both
+    ``target_latency`` and ``latency_factor`` times the fastest time to
+    first byte seen, so servers that are always slow to answer big queries
+    are judged against their own baseline. Waiting requests are queued
+    per flow (one flow per layer in a batch) and granted slots round-robin, so
+    a huge layer cannot starve a small one sharing the same host.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32,
+                 target_latency: float = 2.0, latency_factor: float = 3.0):
+        self.limit = min(initial, maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.latency_factor = latency_factor
+        self.baseline = float("inf")
+        self.active = 0
+        self._successes = 0
+        self._waiters: "OrderedDict[object, deque]" = OrderedDict()
+
+    async def acquire(self, flow=None):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(flow, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just before cancellation; hand it on
+                self.release()
+            else:
+                queue = self._waiters.get(flow)
+                if queue and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[flow]
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.active < self.limit and self._waiters:
+            # Serve the flow at the head, then rotate it to the back
+            flow, queue = self._waiters.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                self._waiters[flow] = queue
+            if waiter.cancelled():
+                continue
+            self.active += 1
+            waiter.set_result(None)
+
+    def on_success(self, ttfb: float):
+        """Record a successful response by its time to first byte in seconds."""
+        self.baseline = min(self.baseline, ttfb)
+        if ttfb > max(self.target_latency, self.latency_factor * self.baseline):
+            self._decrease("slow response")
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+            self._wake()
+
+    def on_throttle(self):
+        self._decrease("throttled")
+
+    def _decrease(self, reason: str):
+        new_limit = max(self.minimum, self.limit // 2)
+        if new_limit != self.limit:
+            logging.info(f"Concurrency {self.limit} -> {new_limit} ({reason})")
+        self.limit = new_limit
+        self._successes = 0
+
+
+class FetchEngine:
+    """
+    Asyncio front end over a pooled keep-alive ``requests.Session``.
+
+    Blocking requests run on a thread pool sized to the connection pool so
+    every worker reuses an open TCP/TLS connection. Each host gets its own
+    ``AdaptiveLimiter``, capped by ``host_limits`` when given, and failed
+    requests are retried with jittered exponential backoff. Requests are
+    queued under the flow set in ``current_flow`` for fair sharing.
+    """
+
+    def __init__(self, pool_size: int = 32, initial_concurrency: int = 4,
+                 max_concurrency: int = 32, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_cap: float = 30.0,
+                 timeout: float = 120.0, host_limits: Optional[Dict[str, int]] = None,
+                 target_latency: float = 2.0, latency_factor: float = 3.0):
+        self.pool_size = pool_size
+        self.host_limits = host_limits or {}
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = min(max_concurrency, pool_size)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.target_latency = target_latency
+        self.latency_factor = latency_factor
+
+        self.session = requests.Session()
+        adapter = TimedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._resolved: Dict[str, asyncio.Future] = {}
+
+    def limiter(self, url: str) -> AdaptiveLimiter:
+        host = urlparse(url).netloc
+        if host not in self._limiters:
+            maximum = min(self.host_limits.get(host, self.max_concurrency), self.max_concurrency)
+            self._limiters[host] = AdaptiveLimiter(self.initial_concurrency, maximum=maximum,
+                                                   target_latency=self.target_latency,
+                                                   latency_factor=self.latency_factor)
+        return self._limiters[host]
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter keeps many workers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _resolve(url: str):
+        # Timed once per host; later connections get the answer from the
+        # system resolver's cache, so connect time is mostly TCP/TLS
+        parsed = urlparse(url)
+        start = time.perf_counter()
+        try:
+            socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80),
+                               type=socket.SOCK_STREAM)
+        except OSError:
+            pass  # The request itself will report the failure
+        metrics.add_time("dns", time.perf_counter() - start)
+
+    def _get(self, url: str, params: Optional[Dict]) -> Tuple[requests.Response, bytes, Dict[str, float]]:
+        _connect_time.seconds = 0.0
+        start = time.perf_counter()
+        # Streamed so waiting for the server and reading the body are timed
+        # separately; reading the content returns the connection to the pool
+        response = self.session.get(url, params=params, timeout=self.timeout, stream=True)
+        headers_at = time.perf_counter()
+        content = response.content
+        done_at = time.perf_counter()
+        timings = {"connect": _connect_time.seconds,
+                   "server": headers_at - start - _connect_time.seconds,
+                   "transfer": done_at - headers_at,
+                   "wire_bytes": response.raw.tell() if hasattr(response.raw, "tell") else len(content)}
+        return response, content, timings
+
+    async def get(self, url: str, params: Optional[Dict] = None) -> bytes:
+        loop = asyncio.get_running_loop()
+        limiter = self.limiter(url)
+        host = urlparse(url).netloc
+        last_error = None
+
+        if host not in self._resolved:
+            self._resolved[host] = loop.run_in_executor(self._executor, self._resolve, url)
+        await self._resolved[host]
+
+        flow = current_flow.get()
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(flow)
+            retry_after = None
+            metrics.incr("requests", host=host)
+            try:
+                start = time.perf_counter()
+                response, content, timings = await loop.run_in_executor(self._executor, self._get, url, params)
+                latency = time.perf_counter() - start
+            except requests.exceptions.RequestException as e:
+                last_error = e
+                metrics.incr("errors", host=host)
+            else:
+                metrics.add_time("server", timings["server"])
+                metrics.add_time("transfer", timings["transfer"])
+                metrics.observe_latency(host, latency)
+                metrics.incr("bytes", len(content), host=host)
+                metrics.incr("wire_bytes", timings["wire_bytes"], host=host)
+                metrics.event("request", host=host, status=response.status_code, attempt=attempt,
+                              seconds=round(latency, 6), connect=round(timings["connect"], 6),
+                              server=round(timings["server"], 6), transfer=round(timings["transfer"], 6),
+                              bytes=len(content), wire_bytes=timings["wire_bytes"])
+                if response.status_code in THROTTLE_STATUS:
+                    limiter.on_throttle()
+                    metrics.incr("throttled", host=host)
+                if response.status_code in RETRY_STATUS:
+                    retry_after = response.headers.get("Retry-After")
+                    last_error = requests.exceptions.HTTPError(
+                        f"{response.status_code} for {response.url}", response=response)
+                else:
+                    response.raise_for_status()
+                    # Time to first byte, without connect or body download
+                    limiter.on_success(timings["server"])
+                    return content
+            finally:
+                limiter.release()
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logging.warning(f"Retrying {url} in {delay:.1f}s ({last_error})")
+                metrics.incr("retries", host=host)
+                with metrics.timer("backoff", host=host):
+                    await asyncio.sleep(delay)
+
+        raise FetchError(f"Giving up on {url} after {self.max_retries + 1} attempts: {last_error}")
+
+    async def get_json(self, url: str, params: Optional[Dict] = None) -> Dict:
+        payload = await self.get(url, params)
+        return json.loads(payload)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
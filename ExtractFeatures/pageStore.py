@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+
+class PageStore:
+    """
+    On-disk staging area for downloaded query pages.
+
+    Every page is written to its own file as soon as it arrives and a line is
+    appended to an NDJSON checkpoint manifest. A rerun pointed at the same
+    staging directory only has to fetch the pages that are not in the manifest.
+    """
+
+    MANIFEST = "manifest.ndjson"
+
+    def __init__(self, staging_dir: str):
+        self.staging_dir = staging_dir
+        self.pages_dir = os.path.join(staging_dir, "pages")
+        self.manifest_path = os.path.join(staging_dir, self.MANIFEST)
+        self._lock = threading.Lock()
+        os.makedirs(self.pages_dir, exist_ok=True)
+        self._done = self._read_manifest()
+        if self._done:
+            logging.info(f"Resuming from checkpoint: {len(self._done)} pages already staged")
+
+    def _read_manifest(self) -> Dict[str, Dict]:
+        done = {}
+        if not os.path.exists(self.manifest_path):
+            return done
+        with open(self.manifest_path, "r", encoding="utf-8") as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves a partial last line; that page is refetched
+                    continue
+                if os.path.exists(os.path.join(self.pages_dir, entry["file"])):
+                    done[entry["key"]] = entry
+        return done
+
+    def is_done(self, key: str) -> bool:
+        return key in self._done
+
+    def done_keys(self) -> List[str]:
+        return list(self._done)
+
+    def write(self, key: str, payload: bytes, count: int, ext: str = "json") -> str:
+        """Write a page to disk, then record it in the manifest."""
+        file_name = f"{key.replace(':', '_')}.{ext}"
+        path = os.path.join(self.pages_dir, file_name)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as page:
+            page.write(payload)
+        os.replace(tmp_path, path)
+
+        entry = {"key": key, "file": file_name, "count": count, "bytes": len(payload)}
+        with self._lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as manifest:
+                manifest.write(json.dumps(entry) + "\n")
+            self._done[key] = entry
+        return path
+
+    def pages(self) -> Iterator[Tuple[str, str]]:
+        """Yield (key, path) for every staged page in key order."""
+        with self._lock:
+            entries = sorted(self._done.items(), key=lambda item: sort_key(item[0]))
+        for key, entry in entries:
+            yield key, os.path.join(self.pages_dir, entry["file"])
+
+    def feature_count(self) -> int:
+        return sum(entry["count"] for entry in self._done.values())
+
+    def byte_count(self) -> int:
+        return sum(entry.get("bytes", 0) for entry in self._done.values())
+
+
+def range_key(kind: str, lo: int, hi: int) -> str:
+    return f"{kind}:{lo}-{hi}"
+
+
+def parse_key(key: str) -> Tuple[str, int, int]:
+    kind, span = key.split(":", 1)
+    lo, hi = span.split("-", 1)
+    return kind, int(lo), int(hi)
+
+
+def sort_key(key: str) -> Tuple[str, int, int]:
+    return parse_key(key)
@@ -0,0 +1,410 @@
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Enum values from Esri's FeatureCollection.proto (f=pbf query responses)
+GEOMETRY_TYPES = {
+    0: "esriGeometryPoint",
+    1: "esriGeometryMultipoint",
+    2: "esriGeometryPolyline",
+    3: "esriGeometryPolygon",
+    4: "esriGeometryMultipatch",
+    127: "esriGeometryNull",
+}
+
+FIELD_TYPES = {
+    0: "esriFieldTypeSmallInteger",
+    1: "esriFieldTypeInteger",
+    2: "esriFieldTypeSingle",
+    3: "esriFieldTypeDouble",
+    4: "esriFieldTypeString",
+    5: "esriFieldTypeDate",
+    6: "esriFieldTypeOID",
+    7: "esriFieldTypeGeometry",
+    8: "esriFieldTypeBlob",
+    9: "esriFieldTypeRaster",
+    10: "esriFieldTypeGUID",
+    11: "esriFieldTypeGlobalID",
+    12: "esriFieldTypeXML",
+}
+
+VARINT, FIXED64, LENGTH, FIXED32 = 0, 1, 2, 5
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _iter_fields(buf: bytes, start: int, end: int) -> Iterator[Tuple[int, int, object]]:
+    """Yield (field number, wire type, value) for one message.
+
+    Length-delimited values are returned as a (start, end) slice into buf so
+    nested messages and packed arrays are never copied.
+    """
+    pos = start
+    while pos < end:
+        tag, pos = _read_varint(buf, pos)
+        field_no, wire_type = tag >> 3, tag & 0x07
+        if wire_type == VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == LENGTH:
+            size, pos = _read_varint(buf, pos)
+            value = (pos, pos + size)
+            pos += size
+        elif wire_type == FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field_no, wire_type, value
+
+
+def _find(buf: bytes, start: int, end: int, field_no: int) -> Optional[Tuple[int, int]]:
+    for number, _, value in _iter_fields(buf, start, end):
+        if number == field_no:
+            return value
+    return None
+
+
+def _double(raw: bytes) -> float:
+    return struct.unpack("<d", raw)[0]
+
+
+def decode_packed_varints(buf: np.ndarray) -> np.ndarray:
+    """Decode a packed run of varints in one vectorized pass."""
+    if buf.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(ends.size), ends - starts + 1)
+    shift = (np.arange(buf.size) - starts[group]) * 7
+    parts = (buf & 0x7F).astype(np.uint64) << shift.astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def zigzag_decode(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+class FeaturePage:
+    """
+    Columnar view of one query page.
+
+    Geometry is held as a flat ``coords`` array (one row per vertex) with
+    ``part_lengths`` giving vertices per part and ``feature_parts`` giving
+    parts per feature. Attributes are one list per field. Nothing is
+    expanded into per-feature dictionaries unless ``to_esri_json`` is called.
+    """
+
+    def __init__(self):
+        self.object_id_field = None
+        self.geometry_type = "esriGeometryNull"
+        self.spatial_reference = {}
+        self.exceeded_transfer_limit = False
+        self.has_z = False
+        self.has_m = False
+        self.fields: List[Tuple[str, str]] = []
+        self.field_lengths: Dict[str, int] = {}
+        self.attributes: Dict[str, list] = {}
+        self.coords = np.zeros((0, 2))
+        self.part_lengths = np.zeros(0, dtype=np.int64)
+        self.feature_parts = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.feature_parts)
+
+    def _geometry_json(self, coords: np.ndarray, lengths: np.ndarray) -> Optional[Dict]:
+        if len(lengths) == 0 and len(coords) == 0:
+            return None
+        rows = coords.tolist()
+        if self.geometry_type == "esriGeometryPoint":
+            point = {"x": rows[0][0], "y": rows[0][1]}
+            extra = rows[0][2:]
+            if self.has_z:
+                point["z"] = extra.pop(0)
+            if self.has_m:
+                point["m"] = extra.pop(0)
+            return point
+        if self.geometry_type == "esriGeometryMultipoint":
+            return {"points": rows}
+        parts = []
+        offset = 0
+        for length in lengths.tolist():
+            parts.append(rows[offset:offset + length])
+            offset += length
+        key = "rings" if self.geometry_type == "esriGeometryPolygon" else "paths"
+        return {key: parts}
+
+    def geometry_slices(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (vertex rows, part lengths) for every feature in order."""
+        part_offsets = np.concatenate(([0], np.cumsum(self.feature_parts)))
+        vertex_offsets = np.concatenate(([0], np.cumsum(self.part_lengths)))
+        point_offset = 0
+        for i in range(len(self)):
+            lengths = self.part_lengths[part_offsets[i]:part_offsets[i + 1]]
+            if self.geometry_type == "esriGeometryPoint":
+                # Points carry no lengths array: one vertex when geometry is present
+                n = int(self.feature_parts[i])
+                coords = self.coords[point_offset:point_offset + n]
+                point_offset += n
+            else:
+                coords = self.coords[vertex_offsets[part_offsets[i]]:vertex_offsets[part_offsets[i + 1]]]
+            yield coords, lengths
+
+    def geometries(self) -> Iterator[Optional[Dict]]:
+        for coords, lengths in self.geometry_slices():
+            yield self._geometry_json(coords, lengths)
+
+    def add_column(self, name: str, field_type: str, values: list):
+        self.fields.append((name, field_type))
+        self.attributes[name] = values
+
+    @property
+    def nbytes(self) -> int:
+        """Rough in-memory size, used for write batch budgets."""
+        attribute_bytes = sum(64 * len(column) for column in self.attributes.values())
+        return int(self.coords.nbytes + self.part_lengths.nbytes + attribute_bytes)
+
+    @classmethod
+    def from_esri_json(cls, js: Dict) -> "FeaturePage":
+        page = cls()
+        page.object_id_field = js.get("objectIdFieldName")
+        page.geometry_type = js.get("geometryType", "esriGeometryNull")
+        page.spatial_reference = js.get("spatialReference", {})
+        page.exceeded_transfer_limit = bool(js.get("exceededTransferLimit"))
+        page.has_z = bool(js.get("hasZ"))
+        page.has_m = bool(js.get("hasM"))
+        page.fields = [(f["name"], f["type"]) for f in js.get("fields", [])]
+        page.field_lengths = {f["name"]: f["length"] for f in js.get("fields", []) if "length" in f}
+        features = js.get("features", [])
+        for name, _ in page.fields:
+            page.attributes[name] = [feature["attributes"].get(name) for feature in features]
+
+        dims = 2 + page.has_z + page.has_m
+        rows = []
+        part_lengths = []
+        feature_parts = []
+        key = {"esriGeometryPolygon": "rings", "esriGeometryPolyline": "paths",
+               "esriGeometryMultipoint": "points"}.get(page.geometry_type)
+        for feature in features:
+            geometry = feature.get("geometry")
+            if not geometry:
+                feature_parts.append(0)
+            elif page.geometry_type == "esriGeometryPoint":
+                if geometry.get("x") is None:
+                    feature_parts.append(0)
+                    continue
+                row = [geometry["x"], geometry["y"]]
+                if page.has_z:
+                    row.append(geometry.get("z"))
+                if page.has_m:
+                    row.append(geometry.get("m"))
+                rows.append(row)
+                feature_parts.append(1)
+            elif key == "points":
+                rows.extend(point[:dims] for point in geometry["points"])
+                part_lengths.append(len(geometry["points"]))
+                feature_parts.append(1)
+            else:
+                for part in geometry.get(key, []):
+                    rows.extend(point[:dims] for point in part)
+                    part_lengths.append(len(part))
+                feature_parts.append(len(geometry.get(key, [])))
+        page.coords = np.asarray(rows, dtype=np.float64).reshape(-1, dims)
+        page.part_lengths = np.asarray(part_lengths, dtype=np.int64)
+        page.feature_parts = np.asarray(feature_parts, dtype=np.int64)
+        return page
+
+    def to_esri_json(self) -> Dict:
+        names = [name for name, _ in self.fields]
+        features = []
+        for i, geometry in enumerate(self.geometries()):
+            feature = {"attributes": {name: self.attributes[name][i] for name in names}}
+            if geometry is not None:
+                feature["geometry"] = geometry
+            features.append(feature)
+        js = {
+            "objectIdFieldName": self.object_id_field,
+            "geometryType": self.geometry_type,
+            "spatialReference": self.spatial_reference,
+            "hasZ": self.has_z,
+            "hasM": self.has_m,
+            "fields": [{"name": name, "type": ftype} for name, ftype in self.fields],
+            "features": features,
+        }
+        if self.exceeded_transfer_limit:
+            js["exceededTransferLimit"] = True
+        return js
+
+
+def _feature_result(buf: bytes) -> Tuple[int, int]:
+    query_result = _find(buf, 0, len(buf), 2)
+    if query_result is None:
+        raise ValueError("PBF payload has no query result")
+    feature_result = _find(buf, query_result[0], query_result[1], 1)
+    if feature_result is None:
+        raise ValueError("PBF payload is not a feature result")
+    return feature_result
+
+
+def scan(payload: bytes) -> Tuple[int, bool]:
+    """Return (feature count, exceededTransferLimit) without decoding features."""
+    start, end = _feature_result(payload)
+    count = 0
+    exceeded = False
+    for number, _, value in _iter_fields(payload, start, end):
+        if number == 15:
+            count += 1
+        elif number == 9:
+            exceeded = bool(value)
+    return count, exceeded
+
+
+def _decode_value(buf: bytes, start: int, end: int):
+    for number, _, value in _iter_fields(buf, start, end):
+        if number == 1:
+            return buf[value[0]:value[1]].decode("utf-8")
+        if number == 2:
+            return struct.unpack("<f", value)[0]
+        if number == 3:
+            return _double(value)
+        if number in (4, 8):
+            return _zigzag(value)
+        if number in (5, 6, 7):
+            # int64 is two's complement on the wire
+            return value - (1 << 64) if number == 6 and value >= 1 << 63 else value
+        if number == 9:
+            return bool(value)
+    return None
+
+
+def decode(payload: bytes) -> FeaturePage:
+    """Decode an f=pbf query response into a FeaturePage."""
+    page = FeaturePage()
+    start, end = _feature_result(payload)
+    scale = [1.0, 1.0, 1.0, 1.0]
+    translate = [0.0, 0.0, 0.0, 0.0]
+    upper_left = True
+    feature_spans = []
+
+    for number, _, value in _iter_fields(payload, start, end):
+        if number == 1:
+            page.object_id_field = payload[value[0]:value[1]].decode("utf-8")
+        elif number == 7:
+            page.geometry_type = GEOMETRY_TYPES.get(value, "esriGeometryNull")
+        elif number == 8:
+            for n, _, v in _iter_fields(payload, value[0], value[1]):
+                if n == 1:
+                    page.spatial_reference["wkid"] = v
+                elif n == 2:
+                    page.spatial_reference["latestWkid"] = v
+                elif n == 5:
+                    page.spatial_reference["wkt"] = payload[v[0]:v[1]].decode("utf-8")
+        elif number == 9:
+            page.exceeded_transfer_limit = bool(value)
+        elif number == 10:
+            page.has_z = bool(value)
+        elif number == 11:
+            page.has_m = bool(value)
+        elif number == 12:
+            for n, _, v in _iter_fields(payload, value[0], value[1]):
+                if n == 1:
+                    upper_left = v == 0
+                elif n in (2, 3):
+                    target = scale if n == 2 else translate
+                    # Scale/Translate messages are ordered x, y, m, z
+                    for axis, _, raw in _iter_fields(payload, v[0], v[1]):
+                        target[axis - 1] = _double(raw)
+        elif number == 13:
+            name = ftype = None
+            for n, _, v in _iter_fields(payload, value[0], value[1]):
+                if n == 1:
+                    name = payload[v[0]:v[1]].decode("utf-8")
+                elif n == 2:
+                    ftype = FIELD_TYPES.get(v, "esriFieldTypeString")
+            page.fields.append((name, ftype))
+        elif number == 15:
+            feature_spans.append(value)
+
+    names = [name for name, _ in page.fields]
+    columns = [[] for _ in names]
+    coord_chunks = []
+    coord_counts = []
+    part_lengths = []
+    feature_parts = []
+
+    for f_start, f_end in feature_spans:
+        index = 0
+        parts = 0
+        n_values = 0
+        for number, _, value in _iter_fields(payload, f_start, f_end):
+            if number == 1:
+                columns[index].append(_decode_value(payload, value[0], value[1]))
+                index += 1
+            elif number == 2:
+                for n, _, v in _iter_fields(payload, value[0], value[1]):
+                    if n == 2:
+                        lengths = decode_packed_varints(np.frombuffer(payload, np.uint8, v[1] - v[0], v[0]))
+                        part_lengths.extend(lengths.tolist())
+                        parts = len(lengths)
+                    elif n == 3:
+                        chunk = np.frombuffer(payload, np.uint8, v[1] - v[0], v[0])
+                        coord_chunks.append(chunk)
+                        n_values = int(np.count_nonzero(chunk < 0x80))
+        if page.geometry_type == "esriGeometryPoint":
+            parts = 1 if n_values else 0
+        elif n_values and not parts:
+            # Single-part geometries may omit the lengths array
+            part_lengths.append(n_values // (2 + page.has_z + page.has_m))
+            parts = 1
+        feature_parts.append(parts)
+        coord_counts.append(n_values)
+
+    for name, column in zip(names, columns):
+        page.attributes[name] = column
+    page.part_lengths = np.asarray(part_lengths, dtype=np.int64)
+    page.feature_parts = np.asarray(feature_parts, dtype=np.int64)
+
+    dims = 2 + page.has_z + page.has_m
+    if coord_chunks:
+        # Coordinates are zigzag deltas that restart at every feature, so
+        # decode everything at once and undo the deltas with a segmented cumsum
+        deltas = zigzag_decode(decode_packed_varints(np.concatenate(coord_chunks))).reshape(-1, dims)
+        vertices = np.asarray(coord_counts, dtype=np.int64) // dims
+        totals = np.cumsum(deltas, axis=0)
+        starts = np.concatenate(([0], np.cumsum(vertices)[:-1]))
+        has_prev = starts > 0
+        base_rows = np.zeros((len(vertices), dims), dtype=totals.dtype)
+        base_rows[has_prev] = totals[starts[has_prev] - 1]
+        base = np.repeat(base_rows, vertices, axis=0)
+        quantized = (totals - base).astype(np.float64)
+
+        axes = [0, 1] + ([3] if page.has_z else []) + ([2] if page.has_m else [])
+        coords = np.empty_like(quantized)
+        for column, axis in enumerate(axes):
+            if axis == 1 and upper_left:
+                coords[:, column] = translate[axis] - scale[axis] * quantized[:, column]
+            else:
+                coords[:, column] = translate[axis] + scale[axis] * quantized[:, column]
+        page.coords = coords
+    else:
+        page.coords = np.zeros((0, dims))
+
+    return page
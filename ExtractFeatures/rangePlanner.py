@@ -0,0 +1,93 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class RangePlanner:
+    """
+    Plans OBJECTID range queries from just the min/max/count statistics.
+
+    Ranges are cut lazily from a cursor that walks the ID space, sized so the
+    expected feature count fills about ``fill`` of a page. The density estimate
+    is updated from every response: runs of empty or sparse ranges widen the
+    next ones (merging empty ID space into a single request), and a range that
+    comes back with ``exceededTransferLimit`` is split in half and requeued.
+    Ranges already recorded in a checkpoint are skipped.
+    """
+
+    def __init__(self, min_id: int, max_id: int, count: int, page_size: int,
+                 done: Iterable[Tuple[int, int]] = (), fill: float = 0.8, smoothing: float = 0.3):
+        self.min_id = min_id
+        self.max_id = max_id
+        self.target = max(1.0, page_size * fill)
+        self.smoothing = smoothing
+        self.density = max(count, 1) / (max_id - min_id + 1)
+        self.cursor = min_id
+        self.retry = deque()
+        self.in_flight: Dict[Tuple[int, int], bool] = {}
+        self.done = sorted(done)
+
+    @property
+    def width(self) -> int:
+        return int(max(1, min(self.max_id - self.min_id + 1, self.target / max(self.density, 1e-12))))
+
+    def _skip_done(self, lo: int) -> Tuple[int, Optional[int]]:
+        """Move lo past any checkpointed interval; return it and the next interval start."""
+        for start, end in self.done:
+            if end < lo:
+                continue
+            if start <= lo:
+                lo = end + 1
+                continue
+            return lo, start
+        return lo, None
+
+    def next_range(self) -> Optional[Tuple[int, int]]:
+        if self.retry:
+            rng = self.retry.popleft()
+        else:
+            lo, next_done = self._skip_done(self.cursor)
+            if lo > self.max_id:
+                self.cursor = lo
+                return None
+            hi = min(lo + self.width - 1, self.max_id)
+            if next_done is not None:
+                hi = min(hi, next_done - 1)
+            self.cursor = hi + 1
+            rng = (lo, hi)
+        self.in_flight[rng] = True
+        return rng
+
+    def report(self, lo: int, hi: int, count: int, exceeded: bool) -> bool:
+        """Record a response. Returns False when the page must be discarded."""
+        self.in_flight.pop((lo, hi), None)
+        span = hi - lo + 1
+        observed = count / span
+        if exceeded:
+            # The true density is at least what came back
+            self.density = max(self.density, observed)
+            if hi > lo:
+                mid = (lo + hi) // 2
+                self.retry.appendleft((mid + 1, hi))
+                self.retry.appendleft((lo, mid))
+                return False
+        self.density = (1 - self.smoothing) * self.density + self.smoothing * observed
+        return True
+
+    def failed(self, lo: int, hi: int):
+        # Left out of the checkpoint so the next run picks it up
+        self.in_flight.pop((lo, hi), None)
+
+    def finished(self) -> bool:
+        return not self.retry and not self.in_flight and self._skip_done(self.cursor)[0] > self.max_id
+
+    def low_watermark(self) -> int:
+        """Smallest OBJECTID that may still be fetched (everything below is settled)."""
+        candidates: List[int] = [lo for lo, _ in self.in_flight]
+        candidates.extend(lo for lo, _ in self.retry)
+        candidates.append(self._skip_done(self.cursor)[0])
+        return min(candidates)
+
+
+def offset_pages(total: int, page_size: int) -> List[Tuple[int, int]]:
+    """Split a result set of ``total`` rows into (offset, count) pages."""
+    return [(offset, min(page_size, total - offset)) for offset in range(0, total, page_size)]
@@ -0,0 +1,234 @@
+import json
+import time
+import bisect
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, TextIO, Tuple
+
+# Stages that spend their time waiting on the network rather than the CPU
+NETWORK_STAGES = ("dns", "connect", "server", "transfer", "backoff")
+CPU_STAGES = ("parse", "stage", "load")
+# Wall-clock waits that contain other stages' time (the final writes of a
+# layer are also timed as parse and load); shown but not summed
+WALL_STAGES = ("merge",)
+
+# Upper bounds (seconds) of the per-host request latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Bucket upper bound below which ``q`` of the observations fall."""
+        target = q * self.count
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Thread-safe per-stage timers, counters and per-host latency histograms.
+
+    Totals are always kept in memory (a lock and a few dict updates per
+    event). When a metrics file is opened every event is also appended to it
+    as one JSON line, and ``serve`` exposes the totals in the Prometheus text
+    format for scraping during long runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.started = time.perf_counter()
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.latency: Dict[str, Histogram] = {}
+
+    def open(self, path: str):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+        if self._file:
+            self.event("summary", **self.snapshot())
+            self._file.close()
+            self._file = None
+
+    def event(self, kind: str, **fields):
+        if self._file is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": kind, **fields})
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add_time(stage, seconds)
+            self.event("stage", stage=stage, seconds=round(seconds, 6), **fields)
+
+    def incr(self, name: str, value: float = 1, host: str = ""):
+        with self._lock:
+            key = (name, host)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_latency(self, host: str, seconds: float):
+        with self._lock:
+            if host not in self.latency:
+                self.latency[host] = Histogram()
+            self.latency[host].observe(seconds)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def snapshot(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            counters: Dict[str, float] = {}
+            for (name, _), value in self.counters.items():
+                counters[name] = counters.get(name, 0) + value
+            return {
+                "elapsed": round(elapsed, 3),
+                "stages": {stage: round(seconds, 6) for stage, seconds in self.stage_seconds.items()},
+                "counters": counters,
+                "features_per_sec": round(counters.get("features", 0) / max(elapsed, 1e-9), 1),
+                "hosts": {host: {"requests": h.count, "mean": round(h.total / h.count, 4) if h.count else 0,
+                                 "p50": h.quantile(0.5), "p95": h.quantile(0.95)}
+                          for host, h in self.latency.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Render the totals in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            lines.append("# TYPE extract_stage_seconds_total counter")
+            for stage, seconds in sorted(self.stage_seconds.items()):
+                lines.append(f'extract_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+            lines.append("# TYPE extract_stage_calls_total counter")
+            for stage, calls in sorted(self.stage_calls.items()):
+                lines.append(f'extract_stage_calls_total{{stage="{stage}"}} {calls}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE extract_{name}_total counter")
+                for (key, host), value in sorted(self.counters.items()):
+                    if key == name:
+                        label = f'{{host="{host}"}}' if host else ""
+                        lines.append(f"extract_{name}_total{label} {value:g}")
+            lines.append("# TYPE extract_request_seconds histogram")
+            for host, h in sorted(self.latency.items()):
+                running = 0
+                for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                    running += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'extract_request_seconds_bucket{{host="{host}",le="{le}"}} {running}')
+                lines.append(f'extract_request_seconds_sum{{host="{host}"}} {h.total:.6f}')
+                lines.append(f'extract_request_seconds_count{{host="{host}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, address: str = "127.0.0.1"):
+        """Serve ``/metrics`` on a background thread until ``close``."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Serving Prometheus metrics on http://{address}:{self._server.server_port}/metrics")
+
+    def profile(self) -> str:
+        """Per-stage breakdown, with network and CPU time totalled separately."""
+        snap = self.snapshot()
+        stages = snap["stages"]
+        with self._lock:
+            calls = dict(self.stage_calls)
+        busy = sum(seconds for stage, seconds in stages.items() if stage not in WALL_STAGES) or 1e-9
+        rows = [f"{'stage':<10}{'calls':>10}{'seconds':>12}{'share':>8}"]
+        known = NETWORK_STAGES + CPU_STAGES + WALL_STAGES
+        for stage in known + tuple(s for s in stages if s not in known):
+            if stage in stages:
+                share = "-" if stage in WALL_STAGES else f"{stages[stage] / busy:.1%}"
+                rows.append(f"{stage:<10}{calls.get(stage, 0):>10}{stages[stage]:>12.2f}{share:>8}")
+        network = sum(stages.get(s, 0) for s in NETWORK_STAGES)
+        cpu = sum(stages.get(s, 0) for s in CPU_STAGES)
+        counters = snap["counters"]
+        rows.append("")
+        rows.append(f"network {network:.2f}s, cpu/disk {cpu:.2f}s (summed across workers) "
+                    f"-> {'network' if network >= cpu else 'CPU/disk'} bound")
+        rows.append(f"{snap['elapsed']:.1f}s wall, {counters.get('requests', 0):g} requests, "
+                    f"{counters.get('retries', 0):g} retries, {counters.get('bytes', 0) / 1e6:.1f} MB, "
+                    f"{counters.get('features', 0):g} features ({snap['features_per_sec']}/s)")
+        for host, stats in snap["hosts"].items():
+            rows.append(f"{host}: {stats['requests']} requests, mean {stats['mean']:.3f}s, "
+                        f"p50 <= {stats['p50']:g}s, p95 <= {stats['p95']:g}s")
+        return "\n".join(rows)
+
+
+# Process-wide sink; the engine, decoders and writers all report here
+metrics = Metrics()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--metrics-file", help="Append per-request and per-stage events to this JSON-lines file")
+    parser.add_argument("--prometheus-port", type=int,
+                        help="Serve Prometheus text metrics on this port while the run lasts")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print a per-stage time breakdown at the end of the run")
+
+
+def start(metrics_file: Optional[str] = None, prometheus_port: Optional[int] = None):
+    metrics.started = time.perf_counter()
+    if metrics_file:
+        metrics.open(metrics_file)
+    if prometheus_port is not None:
+        metrics.serve(prometheus_port)
+
+
+def finish(profile: bool = False):
+    if profile:
+        report = metrics.profile()
+        logging.info(f"Stage profile:\n{report}")
+        print(report)
+    metrics.close()
@@ -0,0 +1,59 @@
+import time
+import sqlite3
+from typing import Iterable, Optional, Set, Tuple
+
+
+class SyncState:
+    """
+    SQLite store of what the last sync saw for each layer URL.
+
+    Holds the layer's ``lastEditDate``, the change-tracking server generation
+    (when the service has one) and the full OBJECTID set, which is needed to
+    tell adds from updates and to detect deletes.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS services (
+                url TEXT PRIMARY KEY,
+                last_edit_date INTEGER,
+                server_gen INTEGER,
+                synced_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS oids (
+                url TEXT NOT NULL,
+                oid INTEGER NOT NULL,
+                PRIMARY KEY (url, oid)
+            ) WITHOUT ROWID;
+        """)
+
+    def get(self, url: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        row = self.conn.execute(
+            "SELECT last_edit_date, server_gen FROM services WHERE url = ?", (url,)).fetchone()
+        return row
+
+    def known_oids(self, url: str) -> Set[int]:
+        return {oid for (oid,) in self.conn.execute("SELECT oid FROM oids WHERE url = ?", (url,))}
+
+    def replace_oids(self, url: str, oids: Iterable[int]):
+        with self.conn:
+            self.conn.execute("DELETE FROM oids WHERE url = ?", (url,))
+            self.conn.executemany("INSERT INTO oids (url, oid) VALUES (?, ?)",
+                                  ((url, oid) for oid in oids))
+
+    def apply(self, url: str, adds: Iterable[int], deletes: Iterable[int]):
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO oids (url, oid) VALUES (?, ?)",
+                                  ((url, oid) for oid in adds))
+            self.conn.executemany("DELETE FROM oids WHERE url = ? AND oid = ?",
+                                  ((url, oid) for oid in deletes))
+
+    def mark(self, url: str, last_edit_date: Optional[int], server_gen: Optional[int]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO services (url, last_edit_date, server_gen, synced_at) "
+                "VALUES (?, ?, ?, ?)", (url, last_edit_date, server_gen, time.time()))
+
+    def close(self):
+        self.conn.close()
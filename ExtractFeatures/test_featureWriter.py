@@ -0,0 +1,75 @@
+import os
+import sys
+import sqlite3
+import struct
+
+import pytest
+
+shapely_wkb = pytest.importorskip("shapely.wkb")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from featureWriter import GeoPackageWriter
+from pbfDecoder import FeaturePage
+
+# Esri rings: clockwise outer ring, counter-clockwise hole
+SQUARE = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+HOLE = [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]]
+FAR_SQUARE = [[20, 0], [20, 5], [25, 5], [25, 0], [20, 0]]
+
+
+def _page(geometry_type, geometries, has_z=False):
+    return FeaturePage.from_esri_json({
+        "geometryType": geometry_type,
+        "spatialReference": {"wkid": 3857},
+        "hasZ": has_z,
+        "fields": [{"name": "NAME", "type": "esriFieldTypeString"}],
+        "features": [{"attributes": {"NAME": str(i)}, "geometry": g} for i, g in enumerate(geometries)],
+    })
+
+
+def _read_back(path, table):
+    """Geometries as shapely objects, with the GeoPackage header stripped."""
+    with sqlite3.connect(path) as conn:
+        blobs = [row[0] for row in conn.execute(f'SELECT geom FROM "{table}" ORDER BY fid')]
+    geometries = []
+    for blob in blobs:
+        assert blob[:2] == b"GP"
+        envelope = (blob[3] >> 1) & 0b111
+        header = 8 + {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[envelope]
+        geometries.append(shapely_wkb.loads(bytes(blob[header:])))
+    return geometries
+
+
+def _write(tmp_path, page):
+    path = str(tmp_path / "out.gpkg")
+    writer = GeoPackageWriter(path, "features")
+    writer.write_page(page)
+    writer.close()
+    return _read_back(path, "features")
+
+
+def test_polygon_round_trip(tmp_path):
+    square, holed, multipart = _write(tmp_path, _page("esriGeometryPolygon", [
+        {"rings": [SQUARE]},
+        {"rings": [SQUARE, HOLE]},
+        {"rings": [SQUARE, FAR_SQUARE]},
+    ]))
+    assert square.geom_type == "MultiPolygon" and square.is_valid
+    assert square.area == pytest.approx(100)
+    assert struct.unpack("<BI", shapely_wkb.dumps(square.geoms[0])[:5]) == (1, 3)
+    assert holed.area == pytest.approx(96)
+    assert len(multipart.geoms) == 2 and multipart.area == pytest.approx(125)
+
+
+def test_polygon_z_round_trip(tmp_path):
+    (polygon,) = _write(tmp_path, _page("esriGeometryPolygon",
+                                        [{"rings": [[p + [5.0] for p in SQUARE]]}], has_z=True))
+    assert polygon.geom_type == "MultiPolygon" and polygon.has_z
+    assert polygon.area == pytest.approx(100)
+
+
+def test_polyline_and_multipoint_round_trip(tmp_path):
+    (line,) = _write(tmp_path, _page("esriGeometryPolyline", [{"paths": [[[0, 0], [3, 4]], [[10, 0], [10, 2]]]}]))
+    assert line.geom_type == "MultiLineString" and line.length == pytest.approx(7)
+    (points,) = _write(tmp_path, _page("esriGeometryMultipoint", [{"points": [[1, 2], [3, 4]]}]))
+    assert points.geom_type == "MultiPoint" and len(points.geoms) == 2
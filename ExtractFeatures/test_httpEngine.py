@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from httpEngine import AdaptiveLimiter, FetchEngine, FetchError
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    """Answers each path from a script of (status, delay, headers) responses; the last one repeats."""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        with self.server.lock:
+            self.server.hits[path] = self.server.hits.get(path, 0) + 1
+            script = self.server.scripts[path]
+            status, delay, headers = script.pop(0) if len(script) > 1 else script[0]
+        time.sleep(delay)
+        body = b'{"ok": true}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    httpd.lock = threading.Lock()
+    httpd.scripts, httpd.hits = {}, {}
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _fetch(engine, url):
+    try:
+        return asyncio.run(engine.get(url))
+    finally:
+        engine.close()
+
+
+def test_limit_grows_after_fast_responses_and_halves_on_throttle():
+    limiter = AdaptiveLimiter(initial=4, maximum=6)
+    for _ in range(4):
+        limiter.on_success(0.05)
+    assert limiter.limit == 5
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 1
+
+
+def test_slow_responses_are_judged_against_the_baseline():
+    limiter = AdaptiveLimiter(initial=8, target_latency=2.0, latency_factor=3.0)
+    limiter.on_success(3.0)
+    # Over the target, but within 3x a server that always takes 3 s
+    limiter.on_success(4.0)
+    assert limiter.limit == 8
+    limiter.on_success(10.0)
+    assert limiter.limit == 4
+
+
+def test_waiting_flows_are_served_round_robin():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1)
+        await limiter.acquire()
+        order = []
+
+        async def request(flow):
+            await limiter.acquire(flow)
+            order.append(flow)
+
+        tasks = [asyncio.create_task(request(flow)) for flow in ("big", "big", "big", "small")]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["big", "small", "big", "big"]
+
+
+def test_cancelled_waiter_hands_its_slot_on():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire("a"))
+        second = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        # The slot goes to the first waiter, which is cancelled before it runs
+        limiter.release()
+        first.cancel()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(second, 1)
+        assert first.cancelled()
+        return limiter.active, limiter._waiters
+
+    assert asyncio.run(run()) == (1, {})
+
+
+def test_throttled_requests_retry_after_the_server_delay(server):
+    server.scripts["/query"] = [(429, 0, {"Retry-After": "0"}), (503, 0, {"Retry-After": "0"}), (200, 0, {})]
+    engine = FetchEngine(initial_concurrency=4, backoff_base=0.01)
+    assert _fetch(engine, server.url + "/query") == b'{"ok": true}'
+    assert server.hits["/query"] == 3
+    # 4 -> 2 -> 1 on the throttles, then the fast success grows it back by one
+    assert engine.limiter(server.url).limit == 2
+
+
+def test_retries_are_exhausted_with_a_fetch_error(server):
+    server.scripts["/query"] = [(503, 0, {})]
+    engine = FetchEngine(max_retries=2, backoff_base=0.01)
+    with pytest.raises(FetchError, match="after 3 attempts"):
+        _fetch(engine, server.url + "/query")
+    assert server.hits["/query"] == 3
+
+
+def test_client_errors_are_not_retried(server):
+    server.scripts["/query"] = [(400, 0, {})]
+    engine = FetchEngine(backoff_base=0.01)
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        _fetch(engine, server.url + "/query")
+    assert not isinstance(error.value, FetchError)
+    assert server.hits["/query"] == 1
+
+
+def test_slow_first_byte_halves_the_limit(server):
+    server.scripts["/query"] = [(200, 0, {})] * 3 + [(200, 0.3, {})]
+    engine = FetchEngine(initial_concurrency=8, target_latency=0.1)
+
+    async def run():
+        for _ in range(4):
+            await engine.get(server.url + "/query")
+
+    try:
+        asyncio.run(run())
+    finally:
+        engine.close()
+    assert engine.limiter(server.url).limit == 4
+
+
+def test_backoff_uses_retry_after_when_it_is_a_number():
+    engine = FetchEngine(backoff_base=1.0, backoff_cap=4.0)
+    try:
+        assert engine._backoff(0, "7") == 7.0
+        assert 0 <= engine._backoff(10, "Wed, 21 Oct 2026 07:28:00 GMT") <= 4.0
+    finally:
+        engine.close()
@@ -0,0 +1,214 @@
+import numpy as np
+
+# Vectorized event locator for straight line diagrams. An SLD route is a
+# straight line from (0, 0) to (length, 0) carrying fromM at its start and
+# toM at its end, so an event measure m sits at
+# x = (m - fromM) / (toM - fromM) * length. Routes are indexed once by
+# sorted route ID and every event table is then placed in a few array
+# operations instead of one lookup per event. Routes and events can also be
+# split into fixed-measure tiles so each feature only spans one tile. No
+# arcpy needed.
+
+# Error codes and the LOC_ERROR text MakeRouteEventLayer writes for them
+NO_ERROR = 0
+ROUTE_NOT_FOUND = 1
+ROUTE_LOCATION_NOT_FOUND = 2
+FROM_PARTIAL_MATCH = 3
+TO_PARTIAL_MATCH = 4
+FROM_AND_TO_PARTIAL_MATCH = 5
+
+ERROR_MESSAGES = ("NO ERROR",
+                  "ROUTE NOT FOUND",
+                  "ROUTE LOCATION NOT FOUND",
+                  "FROM-MEASURE PARTIAL MATCH",
+                  "TO-MEASURE PARTIAL MATCH",
+                  "FROM-MEASURE AND TO-MEASURE PARTIAL MATCH")
+
+
+def measure_x(measures, from_measures, to_measures, lengths):
+    """X of each measure on lines running from fromM at x = 0 to toM at x = length."""
+    span = np.asarray(to_measures, dtype=np.float64) - from_measures
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(span != 0, (np.asarray(measures, dtype=np.float64) - from_measures) / span * lengths, 0.0)
+
+
+def tile_index(measures, tile_size):
+    """Tile of each measure, tile k covering [k * tile_size, (k + 1) * tile_size); -1 for NaN."""
+    measures = np.asarray(measures, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return np.where(np.isnan(measures), -1, np.floor(measures / tile_size)).astype(np.int64)
+
+
+def split_by_tiles(from_measures, to_measures, tile_size):
+    """
+    Split measure ranges at tile boundaries.
+
+    Returns ``(source, tile, piece_from, piece_to)`` with one entry per
+    piece, the pieces of each range contiguous and in ascending measure
+    order. A range that runs from a higher to a lower measure keeps that
+    direction within each piece. A NaN range gives a single NaN piece in
+    tile -1 so it is not dropped.
+    """
+    from_m = np.asarray(from_measures, dtype=np.float64)
+    to_m = np.asarray(to_measures, dtype=np.float64)
+    low, high = np.fmin(from_m, to_m), np.fmax(from_m, to_m)
+    missing = np.isnan(from_m) | np.isnan(to_m)
+    with np.errstate(invalid="ignore"):
+        first = np.where(missing, 0, np.floor(low / tile_size)).astype(np.int64)
+        last = np.where(missing, 0, np.ceil(high / tile_size) - 1).astype(np.int64)
+    # A range that ends on a boundary, or has no length, stays in its first tile
+    last = np.maximum(last, first)
+    counts = last - first + 1
+    source = np.repeat(np.arange(len(counts)), counts)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    starts[1:] = np.cumsum(counts)[:-1]
+    tile = first[source] + np.arange(len(source)) - starts[source]
+    piece_low = np.maximum(low[source], tile * tile_size)
+    piece_high = np.minimum(high[source], (tile + 1) * tile_size)
+    descending = from_m[source] > to_m[source]
+    piece_from = np.where(descending, piece_high, piece_low)
+    piece_to = np.where(descending, piece_low, piece_high)
+    tile = np.where(missing[source], -1, tile)
+    return source, tile, piece_from, piece_to
+
+
+def error_text(codes):
+    """LOC_ERROR strings for an array of error codes."""
+    return np.asarray(ERROR_MESSAGES, dtype=object)[np.asarray(codes, dtype=np.int64)]
+
+
+def _as_keys(values, like=None):
+    """
+    Route IDs as a sortable array plus a mask of the ones that are not null.
+
+    ``None`` (and NaN for numeric IDs) never matches a route. When ``like``
+    is given the IDs are cast to its dtype kind so numeric event IDs can be
+    matched against string route IDs and the other way round.
+    """
+    values = list(values) if not isinstance(values, np.ndarray) else values
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        keys = values
+        valid = np.ones(len(keys), dtype=bool)
+    else:
+        valid = np.array([v is not None for v in values], dtype=bool)
+        filled = [v for v in values if v is not None]
+        sample = np.asarray(filled[:1])
+        fill = "" if sample.dtype.kind in "US" else 0
+        keys = np.asarray([v if v is not None else fill for v in values])
+    if like is not None and keys.dtype.kind != like.dtype.kind:
+        if like.dtype.kind in "US":
+            keys = keys.astype(str)
+        else:
+            numeric = np.full(len(keys), np.nan)
+            for i, value in enumerate(keys.tolist()):
+                try:
+                    numeric[i] = float(value)
+                except (TypeError, ValueError):
+                    valid[i] = False
+            keys = numeric
+    if keys.dtype.kind == "f":
+        valid &= ~np.isnan(keys)
+    return keys, valid
+
+
+class RouteIndex:
+    """
+    Route ID -> (fromM, toM, length) index for horizontal SLD routes.
+
+    IDs are kept sorted and looked up with ``np.searchsorted``, so placing
+    k events costs O(k log n) in one vectorized call. When a route ID occurs
+    more than once the first route wins. Measures may increase or decrease
+    along a route.
+    """
+
+    def __init__(self, route_ids, from_measures, to_measures, lengths):
+        keys, valid = _as_keys(route_ids)
+        from_m = np.asarray(from_measures, dtype=np.float64)[valid]
+        to_m = np.asarray(to_measures, dtype=np.float64)[valid]
+        lengths = np.asarray(lengths, dtype=np.float64)[valid]
+        keys = keys[valid]
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        order = order[first]
+        self.ids = keys[first]
+        self.from_measures = from_m[order]
+        self.to_measures = to_m[order]
+        self.lengths = lengths[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, route_ids):
+        """Position of each route ID in the index, -1 when it is not found."""
+        keys, valid = _as_keys(route_ids, self.ids)
+        if len(self.ids) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.ids, keys)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        found = valid & (self.ids[pos] == keys)
+        return np.where(found, pos, -1)
+
+    def _range(self, route):
+        """Low/high measure and slope of each route; route -1 gets NaN."""
+        found = route >= 0
+        r = np.where(found, route, 0)
+        from_m = np.where(found, self.from_measures[r], np.nan)
+        to_m = np.where(found, self.to_measures[r], np.nan)
+        length = np.where(found, self.lengths[r], np.nan)
+        return from_m, to_m, length, np.fmin(from_m, to_m), np.fmax(from_m, to_m)
+
+    def locate_points(self, route_ids, measures):
+        """
+        Place point events.
+
+        Returns ``(x, codes)``. ``x`` is NaN for events whose route is
+        missing or whose measure falls outside the route's measure range.
+        """
+        route = self.lookup(route_ids)
+        measures = np.asarray(measures, dtype=np.float64)
+        from_m, to_m, length, low, high = self._range(route)
+        with np.errstate(invalid="ignore"):
+            on_route = (measures >= low) & (measures <= high)
+        codes = np.where(route < 0, ROUTE_NOT_FOUND,
+                         np.where(on_route, NO_ERROR, ROUTE_LOCATION_NOT_FOUND))
+        x = np.where(on_route, measure_x(measures, from_m, to_m, length), np.nan)
+        return x, codes
+
+    def locate_lines(self, route_ids, from_measures, to_measures):
+        """
+        Place line events.
+
+        Returns ``(x_from, x_to, m_from, m_to, codes)``. An event that runs
+        past either end of its route is cut at the route end and flagged as
+        a partial match, like MakeRouteEventLayer; ``m_from``/``m_to`` are
+        the measures actually placed. Events that do not overlap their route
+        at all get NaN.
+        """
+        route = self.lookup(route_ids)
+        event_from = np.asarray(from_measures, dtype=np.float64)
+        event_to = np.asarray(to_measures, dtype=np.float64)
+        from_m, to_m, length, low, high = self._range(route)
+        with np.errstate(invalid="ignore"):
+            from_out = (event_from < low) | (event_from > high)
+            to_out = (event_to < low) | (event_to > high)
+            overlap = (np.fmax(event_from, event_to) >= low) & (np.fmin(event_from, event_to) <= high)
+        m_from = np.clip(event_from, low, high)
+        m_to = np.clip(event_to, low, high)
+
+        codes = np.full(len(route), NO_ERROR, dtype=np.int64)
+        codes[from_out] = FROM_PARTIAL_MATCH
+        codes[to_out] = TO_PARTIAL_MATCH
+        codes[from_out & to_out] = FROM_AND_TO_PARTIAL_MATCH
+        missing = ~overlap | np.isnan(event_from) | np.isnan(event_to)
+        codes[missing] = ROUTE_LOCATION_NOT_FOUND
+        codes[route < 0] = ROUTE_NOT_FOUND
+
+        placed = codes != ROUTE_NOT_FOUND
+        placed &= codes != ROUTE_LOCATION_NOT_FOUND
+        m_from = np.where(placed, m_from, np.nan)
+        m_to = np.where(placed, m_to, np.nan)
+        x_from = measure_x(m_from, from_m, to_m, length)
+        x_to = measure_x(m_to, from_m, to_m, length)
+        return np.where(placed, x_from, np.nan), np.where(placed, x_to, np.nan), m_from, m_to, codes